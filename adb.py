@@ -0,0 +1,77 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import db_writer
+import session
+from cache import MISSING
+
+# API เดียวกับ db.py แต่ await ได้: งาน SQLite ไปรันบน executor ของตัวเอง ไม่บล็อก event loop
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
+
+
+def _wrap(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+def _wrap_write(fn, future_fn):
+    # ถ้าเปิด group-commit writer อยู่ รอ Future ของ writer ตรงๆ ไม่ต้องกิน thread ของ executor
+    @functools.wraps(fn)
+    async def wrapper(*args):
+        if db_writer.is_running():
+            await asyncio.wrap_future(future_fn(*args))
+            return
+        await run(fn, *args)
+    return wrapper
+
+
+async def ensure_user(user_id: str):
+    if session.is_known(user_id):
+        return
+    await run(session.ensure_user, user_id)
+
+
+async def get_mode(user_id: str) -> str | None:
+    mode = session.cached_mode(user_id)
+    if mode is not MISSING:
+        return mode
+    return await run(session.get_mode, user_id)
+
+
+async def set_mode(user_id: str, mode: str | None):
+    if session.cached_mode(user_id) == mode:
+        return
+    if session.SESSION_WRITE_BEHIND:
+        session.set_mode(user_id, mode)
+        return
+    await run(session.set_mode, user_id, mode)
+
+
+add_diary = _wrap_write(db.add_diary, db.add_diary_future)
+add_todo = _wrap_write(db.add_todo, db.add_todo_future)
+mark_todo_done = _wrap_write(db.mark_todo_done, db.mark_todo_done_future)
+set_journal_idx = _wrap_write(db.set_journal_idx, db.set_journal_idx_future)
+
+list_todo = _wrap(db.list_todo)
+clear_done_todos = _wrap(db.clear_done_todos)
+get_diary_stats = _wrap(db.get_diary_stats)
+get_mood_trend = _wrap(db.get_mood_trend)
+get_sleep_setting = _wrap(db.get_sleep_setting)
+set_sleep = _wrap(db.set_sleep)
+get_journal_idx = _wrap(db.get_journal_idx)
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import zlib
+import argparse
+from datetime import date, datetime, timedelta
+
+import db
+
+# ย้าย diary ที่เก่ากว่า N วันออกจากตาราง hot ไปเก็บแบบบีบอัดใน diary_archive (ต่อ user ต่อเดือน)
+# และบันทึกว่าวันไหนมีบันทึกไว้ใน diary_days เพื่อให้ total/สตรีคยังคำนวณได้ถูก
+DIARY_ARCHIVE_DAYS = int(os.getenv("DIARY_ARCHIVE_DAYS", "180"))
+
+DAYS_UPSERT_SQL = (
+    "INSERT INTO diary_days(user_id, month, day_bits, entries) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(user_id, month) DO UPDATE SET "
+    "day_bits = day_bits | excluded.day_bits, entries = entries + excluded.entries"
+)
+
+
+def _iter_groups(reader, cutoff: str):
+    # คืนทีละก้อน (user_id, month, rows) เรียงตาม user/วัน
+    cur = reader.execute(
+        "SELECT id, user_id, day, score, text, created_at FROM diary WHERE day < ? ORDER BY user_id, day, id",
+        (cutoff,)
+    )
+    key = None
+    rows = []
+    for r in cur:
+        k = (r["user_id"], r["day"][:7])
+        if k != key:
+            if rows:
+                yield key[0], key[1], rows
+            key, rows = k, []
+        rows.append(dict(r))
+    if rows:
+        yield key[0], key[1], rows
+
+
+def _archive_file(path, cutoff: str, batch_groups: int) -> dict:
+    reader = db.connect(path)
+    writer = db.connect(path)
+    db.migrate(writer)
+
+    now = datetime.utcnow().isoformat()
+    moved = 0
+    chunks = 0
+    raw_bytes = 0
+    packed_bytes = 0
+    pending = 0
+
+    writer.execute("BEGIN IMMEDIATE")
+    for user_id, month, rows in _iter_groups(reader, cutoff):
+        bits = 0
+        lines = []
+        for r in rows:
+            bits |= 1 << (int(r["day"][8:10]) - 1)
+            lines.append(json.dumps(
+                {"id": r["id"], "day": r["day"], "score": r["score"], "text": r["text"], "created_at": r["created_at"]},
+                ensure_ascii=False,
+            ))
+        raw = "\n".join(lines).encode("utf-8")
+        data = zlib.compress(raw, 9)
+
+        writer.execute(
+            "INSERT INTO diary_archive(user_id, month, entries, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, month, len(rows), data, now)
+        )
+        writer.execute(DAYS_UPSERT_SQL, (user_id, month, bits, len(rows)))
+        writer.executemany("DELETE FROM diary WHERE id=?", [(r["id"],) for r in rows])
+
+        moved += len(rows)
+        chunks += 1
+        raw_bytes += len(raw)
+        packed_bytes += len(data)
+        pending += 1
+        if pending >= batch_groups:
+            writer.commit()
+            writer.execute("BEGIN IMMEDIATE")
+            pending = 0
+    writer.commit()
+
+    reader.close()
+    writer.close()
+    return {"rows": moved, "chunks": chunks, "raw_bytes": raw_bytes, "packed_bytes": packed_bytes}
+
+
+def archive(older_than_days: int = DIARY_ARCHIVE_DAYS, paths=None, batch_groups: int = 500) -> dict:
+    t0 = time.perf_counter()
+    cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+    total = {"rows": 0, "chunks": 0, "raw_bytes": 0, "packed_bytes": 0}
+    for path in paths or db.shard_paths():
+        res = _archive_file(path, cutoff, batch_groups)
+        for k in total:
+            total[k] += res[k]
+    total["cutoff"] = cutoff
+    total["seconds"] = round(time.perf_counter() - t0, 3)
+    return total
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Move old diary entries into compressed monthly archive chunks")
+    ap.add_argument("--older-than-days", type=int, default=DIARY_ARCHIVE_DAYS)
+    ap.add_argument("--db", nargs="*", default=None, help="SQLite file(s) (default: every shard of DB_PATH)")
+    ap.add_argument("--batch", type=int, default=500, help="user-months per transaction")
+    args = ap.parse_args()
+
+    res = archive(args.older_than_days, args.db, args.batch)
+    print(f"Archived {res['rows']} diary rows before {res['cutoff']} into {res['chunks']} chunks in {res['seconds']}s")
+    if res["raw_bytes"]:
+        print(f"  text {res['raw_bytes']} bytes -> {res['packed_bytes']} bytes compressed")
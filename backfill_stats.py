@@ -0,0 +1,103 @@
+import time
+import heapq
+import argparse
+from datetime import date, datetime, timedelta
+
+import db
+
+# คำนวณ user_stats ใหม่ทั้งหมดจาก diary ในการอ่านตารางรอบเดียว
+# อ่านแบบ stream เรียงตาม (user_id, day) ผ่าน index idx_diary_user_day ไม่โหลดทุก user เข้า memory
+# วันที่ถูก archive แล้วมาจาก diary_days (bit ต่อวัน + จำนวน entry ต่อเดือน) แล้ว merge เข้ากับตาราง hot
+
+UPSERT_SQL = (
+    "INSERT OR REPLACE INTO user_stats(user_id, total, last_day, streak, updated_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+
+def _iter_archived_days(conn):
+    cur = conn.execute("SELECT user_id, month, day_bits, entries FROM diary_days ORDER BY user_id, month")
+    for row in cur:
+        n = row["entries"]
+        for day in db.days_from_bits(row["month"], int(row["day_bits"])):
+            # นับ entries ของทั้งเดือนไว้ที่วันแรก วันที่เหลือนับแค่ว่ามีบันทึก
+            yield row["user_id"], day, n
+            n = 0
+
+
+def iter_user_stats(conn):
+    hot = (
+        (r["user_id"], r["day"], r["n"])
+        for r in conn.execute(
+            "SELECT user_id, day, COUNT(*) AS n FROM diary GROUP BY user_id, day ORDER BY user_id, day"
+        )
+    )
+    user_id = None
+    total = 0
+    last = None
+    run = 0
+    for uid, day, n in heapq.merge(_iter_archived_days(conn), hot):
+        d = date.fromisoformat(day)
+        if uid != user_id:
+            if user_id is not None:
+                yield user_id, total, last.isoformat(), run
+            user_id, total, last, run = uid, 0, None, 0
+        total += n
+        if d == last:
+            continue
+        run = run + 1 if last is not None and d - last == timedelta(days=1) else 1
+        last = d
+    if user_id is not None:
+        yield user_id, total, last.isoformat(), run
+
+
+def _backfill_file(path, batch_size: int, levels: dict) -> int:
+    reader = db.connect(path)
+    writer = db.connect(path)
+    db.migrate(writer)
+
+    now = datetime.utcnow().isoformat()
+    users = 0
+    batch = []
+
+    def flush():
+        writer.executemany(UPSERT_SQL, batch)
+        writer.commit()
+        batch.clear()
+
+    for user_id, total, last_day, streak in iter_user_stats(reader):
+        batch.append((user_id, total, last_day, streak, now))
+        lvl = db._level_from_total(total)["level"]
+        levels[lvl] = levels.get(lvl, 0) + 1
+        users += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    # แถวที่ไม่มี diary เหลือแล้ว (ไม่ควรเกิด แต่กันค่าค้าง)
+    writer.execute("DELETE FROM user_stats WHERE updated_at < ?", (now,))
+    writer.commit()
+    reader.close()
+    writer.close()
+    return users
+
+
+def backfill(paths=None, batch_size: int = 5000) -> dict:
+    t0 = time.perf_counter()
+    levels: dict[int, int] = {}
+    users = 0
+    for path in paths or db.shard_paths():
+        users += _backfill_file(path, batch_size, levels)
+    return {"users": users, "seconds": round(time.perf_counter() - t0, 3), "levels": dict(sorted(levels.items()))}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Recompute user_stats (total/streak/level) from the diary table")
+    ap.add_argument("--db", nargs="*", default=None, help="SQLite file(s) (default: every shard of DB_PATH)")
+    ap.add_argument("--batch", type=int, default=5000, help="users per write transaction")
+    args = ap.parse_args()
+
+    result = backfill(args.db, args.batch)
+    print(f"Recomputed {result['users']} users in {result['seconds']}s")
+    print("Users per level:", result["levels"])
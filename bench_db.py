@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import date, datetime, timedelta
+
+import db
+import backfill_stats
+
+# วัดความเร็ว data layer (db.py) บนประชากรจำลองหลายขนาด แล้วบันทึกผลต่อท้ายไฟล์ไว้เทียบข้ามรอบ
+# ตัวอย่าง: python bench_db.py --scales 10000 100000 --ops 5000
+
+TIMES = [f"{h:02d}:{m:02d}" for h in range(24) for m in (0, 15, 30, 45)]
+POPULAR_BED = ["22:00", "22:30", "23:00", "23:30", "00:00"]
+POPULAR_WAKE = ["05:30", "06:00", "06:30", "07:00", "07:30"]
+
+
+def _uid(i: int) -> str:
+    # หน้าตาเหมือน LINE userId: U + hex 32 ตัว
+    return "U" + f"{i:032x}"
+
+
+def _streak_len(rng: random.Random, max_streak: int) -> int:
+    r = rng.random()
+    if r < 0.25:
+        return 0
+    if r < 0.70:
+        return rng.randint(1, 7)
+    if r < 0.93:
+        return rng.randint(8, 60)
+    return rng.randint(61, max_streak)
+
+
+def populate(base: Path, users: int, seed: int = 1, max_streak: int = 365, batch: int = 50000) -> dict:
+    # เขียนตรงด้วย connection แยก (แบ่งตาม DB_SHARDS เหมือนของจริง) ปิด fsync ระหว่างเติมข้อมูล
+    # แล้วสร้าง user_stats ด้วย backfill ทีเดียว
+    t0 = time.perf_counter()
+    rng = random.Random(seed)
+    today = date.today()
+    now = datetime.utcnow().isoformat()
+
+    paths = db.shard_paths(base)
+    conns = []
+    for path in paths:
+        conn = db.connect(path)
+        db.migrate(conn)
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("BEGIN")
+        conns.append(conn)
+
+    sql = {
+        "users": "INSERT INTO users(user_id, mode, created_at) VALUES (?, NULL, ?)",
+        "diary": "INSERT INTO diary(user_id, day, score, text, created_at) VALUES (?, ?, ?, ?, ?)",
+        "todo": "INSERT INTO todo(user_id, title, status, created_at) VALUES (?, ?, ?, ?)",
+        "sleep": "INSERT INTO sleep_settings(user_id, bedtime, waketime, enabled, updated_at, bed_min, wake_min) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+    }
+    counts = {k: 0 for k in sql}
+    rows = [{k: [] for k in sql} for _ in paths]
+
+    def flush(force=False):
+        for conn, bufs in zip(conns, rows):
+            for k, buf in bufs.items():
+                if buf and (force or len(buf) >= batch):
+                    conn.executemany(sql[k], buf)
+                    counts[k] += len(buf)
+                    buf.clear()
+
+    for i in range(users):
+        uid = _uid(i)
+        out = rows[db.shard_of(uid, len(paths))]
+        out["users"].append((uid, now))
+
+        # สตรีคล่าสุด (ครึ่งหนึ่งจบวันนี้) + บันทึกกระจัดกระจายก่อนหน้า
+        end = today - timedelta(days=0 if rng.random() < 0.5 else rng.randint(1, 30))
+        streak = _streak_len(rng, max_streak)
+        days = [end - timedelta(days=k) for k in range(streak)]
+        start = end - timedelta(days=streak + 1)
+        for _ in range(rng.randint(0, 20)):
+            days.append(start - timedelta(days=rng.randint(0, 700)))
+        for d in sorted(set(days)):
+            for _ in range(1 if rng.random() < 0.9 else 2):
+                score = rng.randint(1, 5) if rng.random() < 0.8 else None
+                out["diary"].append((uid, d.isoformat(), score, "วันนี้มีเรื่องดีๆ " * rng.randint(1, 6), now))
+
+        for k in range(rng.choice((0, 0, 1, 3, 5, 12, 40))):
+            out["todo"].append((uid, f"งาน {k}", "done" if rng.random() < 0.4 else "todo", now))
+
+        if rng.random() < 0.6:
+            bed = rng.choice(POPULAR_BED) if rng.random() < 0.7 else rng.choice(TIMES)
+            wake = rng.choice(POPULAR_WAKE) if rng.random() < 0.7 else rng.choice(TIMES)
+            out["sleep"].append((uid, bed, wake, 1 if rng.random() < 0.8 else 0, now,
+                                 db.minute_of_day(bed), db.minute_of_day(wake)))
+
+        if i % 1000 == 999:
+            flush()
+    flush(force=True)
+    for conn in conns:
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.close()
+
+    backfill_stats.backfill(paths)
+    counts["seconds"] = round(time.perf_counter() - t0, 3)
+    counts["bytes"] = sum(p.stat().st_size for p in paths)
+    return counts
+
+
+def _summary(samples_ns: list[int]) -> dict:
+    s = sorted(samples_ns)
+    n = len(s)
+
+    def pct(p):
+        return round(s[min(n - 1, int(p / 100 * n))] / 1000, 1)
+
+    total = sum(s)
+    return {
+        "n": n,
+        "ops_per_sec": round(n / (total / 1e9), 1) if total else None,
+        "p50_us": pct(50),
+        "p95_us": pct(95),
+        "p99_us": pct(99),
+        "max_us": round(s[-1] / 1000, 1),
+    }
+
+
+def _time(fn, args_iter) -> dict:
+    samples = []
+    for args in args_iter:
+        t = time.perf_counter_ns()
+        fn(*args)
+        samples.append(time.perf_counter_ns() - t)
+    return _summary(samples)
+
+
+def run_ops(users: int, ops: int, seed: int = 2) -> dict:
+    rng = random.Random(seed)
+
+    def uids(n):
+        return [_uid(rng.randrange(users)) for _ in range(n)]
+
+    # อุ่น cache ของ SQLite ก่อนวัด
+    for u in uids(min(ops, 1000)):
+        db.get_diary_stats(u)
+
+    modes = [None, "diary_wait_text", "todo_wait_add", "heal"]
+    result = {
+        "get_diary_stats": _time(db.get_diary_stats, [(u,) for u in uids(ops)]),
+        "list_todo": _time(db.list_todo, [(u,) for u in uids(ops)]),
+        "get_mode": _time(db.get_mode, [(u,) for u in uids(ops)]),
+        "set_mode": _time(db.set_mode, [(u, rng.choice(modes)) for u in uids(ops)]),
+        "add_diary": _time(db.add_diary, [(u, "bench", rng.randint(1, 5)) for u in uids(ops)]),
+        "due_sleep_users": _time(db.due_sleep_users, [(rng.choice(("bed", "wake")), [rng.randrange(1440)]) for _ in range(ops)]),
+        # อ่านทั้งตาราง รอบละครั้ง ใช้จำนวนรอบน้อยกว่า
+        "get_sleep_settings": _time(db.get_sleep_settings, [()] * max(3, min(20, ops // 250))),
+    }
+    return result
+
+
+def _git_rev() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _remove(base: Path):
+    for path in db.shard_paths(base):
+        for p in (path, Path(f"{path}-wal"), Path(f"{path}-shm")):
+            if p.exists():
+                p.unlink()
+
+
+def bench(scales: list[int], ops: int, workdir: Path, keep: bool = False, seed: int = 1, max_streak: int = 365) -> list[dict]:
+    results = []
+    old_path = db.DB_PATH
+    for users in scales:
+        path = workdir / f"bench_{users}.db"
+        _remove(path)
+
+        pop = populate(path, users, seed=seed, max_streak=max_streak)
+        db.close_all()
+        db.DB_PATH = path
+        try:
+            res = run_ops(users, ops)
+        finally:
+            db.close_all()
+            db.DB_PATH = old_path
+        results.append({"users": users, "population": pop, "ops": res})
+
+        if not keep:
+            _remove(path)
+    return results
+
+
+def _print(result: dict):
+    pop = result["population"]
+    print(f"\n== {result['users']} users: {pop['diary']} diary, {pop['todo']} todo, {pop['sleep']} sleep "
+          f"({pop['bytes'] / 1e6:.1f} MB, populated in {pop['seconds']}s)")
+    print(f"{'op':<20}{'ops/s':>12}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'max us':>10}")
+    for op, s in result["ops"].items():
+        print(f"{op:<20}{s['ops_per_sec']:>12}{s['p50_us']:>10}{s['p95_us']:>10}{s['p99_us']:>10}{s['max_us']:>10}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark db.py against synthetic user populations")
+    ap.add_argument("--scales", type=int, nargs="+", default=[10000, 100000], help="user counts to test")
+    ap.add_argument("--ops", type=int, default=2000, help="timed calls per operation")
+    ap.add_argument("--max-streak", type=int, default=365, help="longest generated diary streak (days)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workdir", default=None, help="where to build the temporary databases (default: system temp)")
+    ap.add_argument("--keep", action="store_true", help="keep the generated databases")
+    ap.add_argument("--out", default="bench_results.jsonl", help="append results here (one JSON line per scale)")
+    args = ap.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="bench_db_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    meta = {
+        "at": datetime.utcnow().isoformat(timespec="seconds"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "ops": args.ops,
+        "seed": args.seed,
+        "env": {k: v for k, v in os.environ.items() if k.startswith("DB_")},
+    }
+    results = bench(args.scales, args.ops, workdir, args.keep, args.seed, args.max_streak)
+    with open(args.out, "a", encoding="utf-8") as f:
+        for r in results:
+            _print(r)
+            f.write(json.dumps({**meta, **r}, ensure_ascii=False) + "\n")
+    print(f"\nAppended {len(results)} result(s) to {args.out}")
@@ -1,17 +1,6 @@
-import os
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-TOKEN = os.environ["LINE_CHANNEL_ACCESS_TOKEN"]
-
-HEADERS = {
-    "Authorization": f"Bearer {TOKEN}",
-    "Content-Type": "application/json"
-}
+from line_api import LINE_DATA_API_BASE, line_api_sync
 
 def create_rich_menu():
-    url = "https://api.line.me/v2/bot/richmenu"
     body = {
         "size": {"width": 2500, "height": 1686},
         "selected": True,
@@ -36,27 +25,19 @@ def create_rich_menu():
         ]
     }
 
-    r = requests.post(url, headers=HEADERS, json=body, timeout=30)
-    r.raise_for_status()
+    r = line_api_sync("POST", "/v2/bot/richmenu", json=body, timeout=30)
     richmenu_id = r.json()["richMenuId"]
     print("Created rich menu:", richmenu_id)
     return richmenu_id
 
 def upload_image(richmenu_id: str, image_path: str):
-    url = f"https://api-data.line.me/v2/bot/richmenu/{richmenu_id}/content"
-    headers = {
-        "Authorization": f"Bearer {TOKEN}",
-        "Content-Type": "image/png"
-    }
+    url = f"{LINE_DATA_API_BASE}/v2/bot/richmenu/{richmenu_id}/content"
     with open(image_path, "rb") as f:
-        r = requests.post(url, headers=headers, data=f, timeout=60)
-    r.raise_for_status()
+        line_api_sync("POST", url, headers={"Content-Type": "image/png"}, content=f.read(), timeout=60)
     print("Uploaded image.")
 
 def set_default(richmenu_id: str):
-    url = f"https://api.line.me/v2/bot/user/all/richmenu/{richmenu_id}"
-    r = requests.post(url, headers={"Authorization": f"Bearer {TOKEN}"}, timeout=30)
-    r.raise_for_status()
+    line_api_sync("POST", f"/v2/bot/user/all/richmenu/{richmenu_id}", timeout=30)
     print("Set default rich menu.")
 
 if __name__ == "__main__":
@@ -1,16 +1,101 @@
+import os
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from datetime import datetime, date, timedelta
 import bisect
-
-DB_PATH = Path("data/app.db")
-
-def get_conn():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+import json
+import zlib
+from concurrent.futures import Future
+
+import db_writer
+
+DB_PATH = Path(os.getenv("DB_PATH", "data/app.db"))
+# แบ่ง user ไปหลายไฟล์ตาม hash ของ user_id (1 = ไฟล์เดียวแบบเดิม)
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))
+
+# connection ต่อ thread ใช้ซ้ำตลอด (WAL: reader ไม่ต้องรอ writer)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+TODO_PAGE_SIZE = int(os.getenv("TODO_PAGE_SIZE", "10"))
+MOOD_TREND_WEEKS = int(os.getenv("MOOD_TREND_WEEKS", "8"))
+
+_local = threading.local()
+_all_conns: list[sqlite3.Connection] = []
+_all_conns_lock = threading.Lock()
+
+def connect(path: Path | str | None = None, check_same_thread: bool = True) -> sqlite3.Connection:
+    path = Path(path or DB_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=check_same_thread,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
+def get_conn(path: Path | str | None = None) -> sqlite3.Connection:
+    # ใช้กับ `with get_conn() as conn:` ได้เหมือนเดิม (commit/rollback) แต่ไม่ปิด connection
+    key = str(path or DB_PATH)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(key)
+    if conn is None:
+        conn = connect(key)
+        conns[key] = conn
+        with _all_conns_lock:
+            _all_conns.append(conn)
+    return conn
+
+def shard_path(i: int, base: Path | str | None = None, shards: int | None = None) -> Path:
+    base = Path(base or DB_PATH)
+    if (shards or DB_SHARDS) == 1:
+        return base
+    return base.with_name(f"{base.stem}.{i}{base.suffix}")
+
+def shard_paths(base: Path | str | None = None, shards: int | None = None) -> list[Path]:
+    n = shards or DB_SHARDS
+    return [shard_path(i, base, n) for i in range(n)]
+
+def shard_of(user_id: str, shards: int | None = None) -> int:
+    # crc32 ให้ค่าเดียวกันทุก process (hash() ของ Python สุ่มต่อ process)
+    return zlib.crc32(user_id.encode("utf-8")) % (shards or DB_SHARDS)
+
+def user_db_path(user_id: str) -> Path:
+    return shard_path(shard_of(user_id))
+
+def user_conn(user_id: str) -> sqlite3.Connection:
+    return get_conn(user_db_path(user_id))
+
+def control_conn() -> sqlite3.Connection:
+    # ตารางระดับระบบ (ไม่ผูกกับ user) อยู่ใน shard 0
+    return get_conn(shard_path(0))
+
+def close_all():
+    with _all_conns_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # connection ของ thread อื่น ปิดข้าม thread ไม่ได้ ปล่อยให้ GC จัดการ
+            pass
+    _local.conns = {}
+
 def _add_column_if_missing(cur, table: str, column: str, coldef: str):
     cur.execute(f"PRAGMA table_info({table})")
     cols = [r["name"] for r in cur.fetchall()]
@@ -68,135 +153,441 @@ def _level_from_total(total_entries: int):
         "to_next": to_next,
     }
 
-def init_db():
-    with get_conn() as conn:
-        cur = conn.cursor()
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            mode TEXT DEFAULT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS diary (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            day TEXT NOT NULL,
-            score INTEGER,
-            text TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS todo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT NOT NULL,
-            title TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'todo',
-            created_at TEXT NOT NULL
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS sleep_settings (
-            user_id TEXT PRIMARY KEY,
-            bedtime TEXT,
-            waketime TEXT,
-            enabled INTEGER NOT NULL DEFAULT 0,
-            updated_at TEXT
+def _m001_base_schema(cur):
+    # ตารางเดิมทั้งหมด + คอลัมน์ที่เคยเติมทีหลัง (สำหรับ DB เก่าก่อนมี user_version)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        mode TEXT DEFAULT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS diary (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        score INTEGER,
+        text TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS todo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        title TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'todo',
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sleep_settings (
+        user_id TEXT PRIMARY KEY,
+        bedtime TEXT,
+        waketime TEXT,
+        enabled INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )
+    """)
+
+    _add_column_if_missing(cur, "sleep_settings", "waketime", "TEXT")
+    _add_column_if_missing(cur, "sleep_settings", "updated_at", "TEXT")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS journal_state (
+        user_id TEXT PRIMARY KEY,
+        idx INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )
+    """)
+
+    _add_column_if_missing(cur, "journal_state", "updated_at", "TEXT")
+
+def _m002_secondary_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_diary_user_day ON diary(user_id, day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_todo_user_status_id ON todo(user_id, status, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sleep_enabled ON sleep_settings(user_id) WHERE enabled=1")
+
+def _streak_ending_at(days_desc: list[str]) -> int:
+    # days_desc = วันที่ไม่ซ้ำเรียงจากใหม่ไปเก่า นับวันติดกันจากวันล่าสุด
+    streak = 0
+    expect = None
+    for ds in days_desc:
+        d = date.fromisoformat(ds)
+        if expect is not None and d != expect:
+            break
+        streak += 1
+        expect = d - timedelta(days=1)
+    return streak
+
+def _m003_user_stats(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        last_day TEXT,
+        streak INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    )
+    """)
+
+    # backfill ทีเดียวทั้งตาราง (ไม่วนถาม COUNT/DISTINCT ทีละ user ขณะถือ write lock)
+    # สตรีค = จำนวนวันในกลุ่ม gaps-and-islands เดียวกับวันล่าสุด แบบเดียวกับ STREAK_SQL
+    cur.execute("""
+    WITH d AS (
+        SELECT user_id, day, COUNT(*) AS n FROM diary GROUP BY user_id, day
+    ),
+    g AS (
+        SELECT user_id, day, n,
+               julianday(day) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS grp
+        FROM d
+    ),
+    l AS (
+        SELECT user_id, day, n, grp,
+               FIRST_VALUE(grp) OVER (PARTITION BY user_id ORDER BY day DESC) AS last_grp
+        FROM g
+    )
+    INSERT OR REPLACE INTO user_stats(user_id, total, last_day, streak, updated_at)
+    SELECT user_id, SUM(n), MAX(day), SUM(grp = last_grp), ?
+    FROM l
+    GROUP BY user_id
+    """, (datetime.utcnow().isoformat(),))
+
+def _m004_diary_archive(cur):
+    # ข้อความเก่าถูกบีบอัดเป็นก้อน (zlib ของ JSONL) ต่อ user ต่อเดือน เขียนต่อท้ายอย่างเดียว
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS diary_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        month TEXT NOT NULL,
+        entries INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_diary_archive_user_month ON diary_archive(user_id, month)")
+
+    # วันที่มีบันทึกของเดือนที่ย้ายไปแล้ว: bit (วันที่-1) + จำนวน entry รวม ใช้คำนวณ total/สตรีค
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS diary_days (
+        user_id TEXT NOT NULL,
+        month TEXT NOT NULL,
+        day_bits INTEGER NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month)
+    ) WITHOUT ROWID
+    """)
+
+def _m005_todo_keyset_index(cur):
+    # แบ่งหน้า todo ด้วย cursor (id) ไม่ใช้ OFFSET: ทุกหน้าอ่านเท่าที่แสดง
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_todo_user_id ON todo(user_id, id)")
+
+# สรุปคะแนน mood ต่อ user ต่อช่วง: 'd' = วัน (YYYY-MM-DD), 'w' = สัปดาห์ (วันจันทร์), 'm' = เดือน (YYYY-MM)
+MOOD_ROLLUP_UPSERT = (
+    "INSERT INTO mood_rollup(user_id, period, bucket, score_sum, scored, entries) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(user_id, period, bucket) DO UPDATE SET "
+    "score_sum = score_sum + excluded.score_sum, scored = scored + excluded.scored, entries = entries + excluded.entries"
+)
+
+def _mood_buckets(day: str) -> list[tuple[str, str]]:
+    d = date.fromisoformat(day)
+    return [("d", day), ("w", (d - timedelta(days=d.weekday())).isoformat()), ("m", day[:7])]
+
+def _m006_mood_rollup(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS mood_rollup (
+        user_id TEXT NOT NULL,
+        period TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        scored INTEGER NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, period, bucket)
+    ) WITHOUT ROWID
+    """)
+
+    # backfill จากตาราง hot (date(day,'weekday 0','-6 days') = วันจันทร์ของสัปดาห์นั้น)
+    for period, expr in (("d", "day"), ("w", "date(day, 'weekday 0', '-6 days')"), ("m", "substr(day, 1, 7)")):
+        cur.execute(
+            "INSERT INTO mood_rollup(user_id, period, bucket, score_sum, scored, entries) "
+            f"SELECT user_id, ?, {expr}, COALESCE(SUM(score), 0), COUNT(score), COUNT(*) FROM diary GROUP BY user_id, {expr} "
+            "ON CONFLICT(user_id, period, bucket) DO NOTHING",
+            (period,)
         )
-        """)
 
-        _add_column_if_missing(cur, "sleep_settings", "waketime", "TEXT")
-        _add_column_if_missing(cur, "sleep_settings", "updated_at", "TEXT")
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS journal_state (
-            user_id TEXT PRIMARY KEY,
-            idx INTEGER NOT NULL DEFAULT 0,
-            updated_at TEXT
-        )
-        """)
-
-        _add_column_if_missing(cur, "journal_state", "updated_at", "TEXT")
+    # ส่วนที่ archive ไปแล้ว: คลายทีละก้อน (1 user x 1 เดือน)
+    for r in cur.execute("SELECT user_id, data FROM diary_archive").fetchall():
+        acc: dict[tuple[str, str], list[int]] = {}
+        for line in zlib.decompress(r["data"]).decode("utf-8").splitlines():
+            e = json.loads(line)
+            for key in _mood_buckets(e["day"]):
+                a = acc.setdefault(key, [0, 0, 0])
+                if e["score"] is not None:
+                    a[0] += int(e["score"])
+                    a[1] += 1
+                a[2] += 1
+        cur.executemany(MOOD_ROLLUP_UPSERT, [(r["user_id"], p, b, *a) for (p, b), a in acc.items()])
+
+def minute_of_day(hhmm: str | None) -> int | None:
+    # "23:30" -> 1410 ค่าที่ parse ไม่ได้ถือว่าไม่ได้ตั้งเวลา
+    if not hhmm:
+        return None
+    try:
+        hh, mm = hhmm.split(":")
+        h, m = int(hh), int(mm)
+    except ValueError:
+        return None
+    if not (0 <= h < 24 and 0 <= m < 60):
+        return None
+    return h * 60 + m
+
+def _m007_sleep_minute_index(cur):
+    # นาทีของวัน (0-1439) ของเวลานอน/ตื่น ให้ dispatcher ดึง user ที่ถึงเวลาด้วย index ทีละนาที
+    _add_column_if_missing(cur, "sleep_settings", "bed_min", "INTEGER")
+    _add_column_if_missing(cur, "sleep_settings", "wake_min", "INTEGER")
+    rows = cur.execute("SELECT user_id, bedtime, waketime FROM sleep_settings").fetchall()
+    cur.executemany(
+        "UPDATE sleep_settings SET bed_min=?, wake_min=? WHERE user_id=?",
+        [(minute_of_day(r["bedtime"]), minute_of_day(r["waketime"]), r["user_id"]) for r in rows]
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sleep_bed_min ON sleep_settings(bed_min) WHERE enabled=1")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sleep_wake_min ON sleep_settings(wake_min) WHERE enabled=1")
+
+def _m008_push_dead_letter(cur):
+    # push/multicast ที่ส่งไม่สำเร็จหลัง retry ครบ (หรือ error ที่ retry ไม่ได้) เก็บไว้ replay ทีหลัง
+    # ใช้ใน control_conn (shard 0) เท่านั้น
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS push_dead_letter (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        retry_key TEXT,
+        status INTEGER,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        replayed_at TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_push_dead_letter_pending ON push_dead_letter(id) WHERE replayed_at IS NULL")
+
+def _m009_scheduler_lease(cur):
+    # lease ของ process ที่เป็น leader ส่งแจ้งเตือน (control_conn) + นาทีล่าสุดที่ส่งแล้ว ให้ leader ถัดไปทำต่อ
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS scheduler_lease (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        last_minute TEXT
+    )
+    """)
+
+# (เลขเวอร์ชัน, ฟังก์ชัน) เพิ่มต่อท้ายเท่านั้น ห้ามแก้ของเดิมที่ deploy ไปแล้ว
+MIGRATIONS = [
+    (1, _m001_base_schema),
+    (2, _m002_secondary_indexes),
+    (3, _m003_user_stats),
+    (4, _m004_diary_archive),
+    (5, _m005_todo_keyset_index),
+    (6, _m006_mood_rollup),
+    (7, _m007_sleep_minute_index),
+    (8, _m008_push_dead_letter),
+    (9, _m009_scheduler_lease),
+]
+
+def _user_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    if _user_version(conn) >= MIGRATIONS[-1][0]:
+        return
+    for version, fn in MIGRATIONS:
+        # BEGIN IMMEDIATE กันหลาย process migrate พร้อมกัน แล้วเช็คเวอร์ชันซ้ำหลังได้ lock
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _user_version(conn) >= version:
+                conn.rollback()
+                continue
+            fn(conn.cursor())
+            conn.execute(f"PRAGMA user_version={version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-        conn.commit()
+def init_db():
+    for path in shard_paths():
+        migrate(get_conn(path))
 
-def upsert_user(user_id: str):
+def upsert_user(user_id: str) -> bool:
     now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
-        conn.execute(
+    with user_conn(user_id) as conn:
+        cur = conn.execute(
             "INSERT OR IGNORE INTO users(user_id, created_at) VALUES (?, ?)",
             (user_id, now)
         )
         conn.commit()
+        return cur.rowcount > 0
+
+def recent_user_ids(limit: int) -> list[str]:
+    per_shard = max(1, int(limit) // DB_SHARDS)
+    out = []
+    for path in shard_paths():
+        with get_conn(path) as conn:
+            rows = conn.execute(
+                "SELECT user_id FROM users ORDER BY rowid DESC LIMIT ?",
+                (per_shard,)
+            ).fetchall()
+        out.extend(r["user_id"] for r in rows)
+    return out
 
 def set_mode(user_id: str, mode: str | None):
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         conn.execute("UPDATE users SET mode=? WHERE user_id=?", (mode, user_id))
         conn.commit()
 
+def set_modes(pairs: list[tuple[str, str | None]]):
+    by_shard: dict[int, list] = {}
+    for user_id, mode in pairs:
+        by_shard.setdefault(shard_of(user_id), []).append((mode, user_id))
+    for i, rows in by_shard.items():
+        with get_conn(shard_path(i)) as conn:
+            conn.executemany("UPDATE users SET mode=? WHERE user_id=?", rows)
+            conn.commit()
+
 def get_mode(user_id: str) -> str | None:
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         row = conn.execute("SELECT mode FROM users WHERE user_id=?", (user_id,)).fetchone()
         return row["mode"] if row else None
 
-def add_diary(user_id: str, text: str, score: int | None):
+def submit_write(user_id: str, fn, *args) -> Future:
+    # fn(conn, user_id, *args) ไม่ commit เอง; ถ้าเปิด writer จะถูกรวม commit เป็น batch (ต่อ shard)
+    path = str(user_db_path(user_id))
+    args = (user_id, *args)
+    if db_writer.is_running():
+        return db_writer.submit(path, fn, *args)
+    fut = Future()
+    try:
+        with get_conn(path) as conn:
+            res = fn(conn, *args)
+            conn.commit()
+        fut.set_result(res)
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+def start_writer():
+    if db_writer.DB_WRITE_BEHIND:
+        db_writer.start(connect)
+
+def stop_writer():
+    db_writer.stop()
+
+def _add_diary_tx(conn, user_id: str, text: str, score: int | None, today: str, yesterday: str, now: str):
+    conn.execute(
+        "INSERT INTO diary(user_id, day, score, text, created_at) VALUES (?, ?, ?, ?, ?)",
+        (user_id, today, score, text, now)
+    )
+    # อัปเดต user_stats ใน transaction เดียวกัน (ค่าฝั่งขวาของ SET อ้างถึงแถวเดิม)
+    conn.execute(
+        "INSERT INTO user_stats(user_id, total, last_day, streak, updated_at) VALUES (?, 1, ?, 1, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET "
+        "total = total + 1, "
+        "streak = CASE WHEN last_day >= excluded.last_day THEN streak "
+        "WHEN last_day = ? THEN streak + 1 ELSE 1 END, "
+        "last_day = CASE WHEN last_day >= excluded.last_day THEN last_day ELSE excluded.last_day END, "
+        "updated_at = excluded.updated_at",
+        (user_id, today, now, yesterday)
+    )
+    has_score = score is not None
+    conn.executemany(
+        MOOD_ROLLUP_UPSERT,
+        [(user_id, p, b, score if has_score else 0, int(has_score), 1) for p, b in _mood_buckets(today)]
+    )
+
+def add_diary_future(user_id: str, text: str, score: int | None) -> Future:
     now = datetime.utcnow().isoformat()
-    today = date.today().isoformat()
-    with get_conn() as conn:
-        conn.execute(
-            "INSERT INTO diary(user_id, day, score, text, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, today, score, text, now)
-        )
-        conn.commit()
+    d = date.today()
+    return submit_write(user_id, _add_diary_tx, text, score, d.isoformat(), (d - timedelta(days=1)).isoformat(), now)
 
-def add_todo(user_id: str, title: str):
-    now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
-        conn.execute(
-            "INSERT INTO todo(user_id, title, status, created_at) VALUES (?, ?, 'todo', ?)",
-            (user_id, title, now)
-        )
-        conn.commit()
+def add_diary(user_id: str, text: str, score: int | None):
+    add_diary_future(user_id, text, score).result()
 
-def list_todo(user_id: str):
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT id, title, status FROM todo WHERE user_id=? ORDER BY id DESC LIMIT 20",
-            (user_id,)
-        ).fetchall()
-        return [dict(r) for r in rows]
+def _add_todo_tx(conn, user_id: str, title: str, now: str):
+    conn.execute(
+        "INSERT INTO todo(user_id, title, status, created_at) VALUES (?, ?, 'todo', ?)",
+        (user_id, title, now)
+    )
+
+def add_todo_future(user_id: str, title: str) -> Future:
+    return submit_write(user_id, _add_todo_tx, title, datetime.utcnow().isoformat())
+
+def add_todo(user_id: str, title: str):
+    add_todo_future(user_id, title).result()
+
+def list_todo(user_id: str, before_id: int | None = None, after_id: int | None = None,
+              limit: int = TODO_PAGE_SIZE) -> dict:
+    # ใหม่ -> เก่า; before_id = หน้าถัดไป (เก่ากว่า), after_id = หน้าก่อน (ใหม่กว่า)
+    with user_conn(user_id) as conn:
+        if after_id is not None:
+            rows = conn.execute(
+                "SELECT id, title, status FROM todo WHERE user_id=? AND id>? ORDER BY id ASC LIMIT ?",
+                (user_id, int(after_id), limit)
+            ).fetchall()[::-1]
+        elif before_id is not None:
+            rows = conn.execute(
+                "SELECT id, title, status FROM todo WHERE user_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                (user_id, int(before_id), limit)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, title, status FROM todo WHERE user_id=? ORDER BY id DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+
+        older = newer = None
+        if rows:
+            first, last = rows[0]["id"], rows[-1]["id"]
+            if conn.execute("SELECT EXISTS(SELECT 1 FROM todo WHERE user_id=? AND id<?)", (user_id, last)).fetchone()[0]:
+                older = last
+            if conn.execute("SELECT EXISTS(SELECT 1 FROM todo WHERE user_id=? AND id>?)", (user_id, first)).fetchone()[0]:
+                newer = first
+        return {"items": [dict(r) for r in rows], "older": older, "newer": newer}
+
+def _mark_todo_done_tx(conn, user_id: str, todo_id: int):
+    conn.execute(
+        "UPDATE todo SET status='done' WHERE user_id=? AND id=?",
+        (user_id, todo_id)
+    )
+
+def mark_todo_done_future(user_id: str, todo_id: int) -> Future:
+    return submit_write(user_id, _mark_todo_done_tx, int(todo_id))
 
 def mark_todo_done(user_id: str, todo_id: int):
-    with get_conn() as conn:
-        conn.execute(
-            "UPDATE todo SET status='done' WHERE user_id=? AND id=?",
-            (user_id, todo_id)
-        )
-        conn.commit()
+    mark_todo_done_future(user_id, todo_id).result()
 
 def clear_done_todos(user_id: str):
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         conn.execute("DELETE FROM todo WHERE user_id=? AND status='done'", (user_id,))
         conn.commit()
 
 def set_sleep(user_id: str, bedtime: str | None, waketime: str | None, enabled: int):
     now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         conn.execute(
-            "INSERT INTO sleep_settings(user_id, bedtime, waketime, enabled, updated_at) VALUES (?, ?, ?, ?, ?) "
-            "ON CONFLICT(user_id) DO UPDATE SET bedtime=excluded.bedtime, waketime=excluded.waketime, enabled=excluded.enabled, updated_at=excluded.updated_at",
-            (user_id, bedtime, waketime, int(enabled), now)
+            "INSERT INTO sleep_settings(user_id, bedtime, waketime, enabled, updated_at, bed_min, wake_min) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET bedtime=excluded.bedtime, waketime=excluded.waketime, enabled=excluded.enabled, "
+            "updated_at=excluded.updated_at, bed_min=excluded.bed_min, wake_min=excluded.wake_min",
+            (user_id, bedtime, waketime, int(enabled), now, minute_of_day(bedtime), minute_of_day(waketime))
         )
         conn.commit()
 
 def get_sleep_setting(user_id: str):
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         row = conn.execute(
             "SELECT bedtime, waketime, enabled FROM sleep_settings WHERE user_id=?",
             (user_id,)
@@ -206,55 +597,196 @@ def get_sleep_setting(user_id: str):
         return {"bedtime": row["bedtime"], "waketime": row["waketime"], "enabled": int(row["enabled"])}
 
 def get_sleep_settings():
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT user_id, bedtime, waketime, enabled FROM sleep_settings WHERE enabled=1"
-        ).fetchall()
-        return [dict(r) for r in rows]
+    out = []
+    for path in shard_paths():
+        with get_conn(path) as conn:
+            rows = conn.execute(
+                "SELECT user_id, bedtime, waketime, enabled FROM sleep_settings WHERE enabled=1"
+            ).fetchall()
+        out.extend(dict(r) for r in rows)
+    return out
+
+SLEEP_MIN_COLUMN = {"bed": "bed_min", "wake": "wake_min"}
+
+def bootstrap_sleep_reminders(batch_size: int = 5000) -> dict:
+    # ตอน start: อ่าน user ที่เปิดแจ้งเตือนรอบเดียวต่อ shard (stream) นับจำนวน
+    # และซ่อม bed_min/wake_min ที่ไม่ตรงกับ bedtime/waketime (เช่นแถวที่ process เวอร์ชันเก่าเขียนระหว่าง deploy)
+    out = {"enabled": 0, "bed": 0, "wake": 0, "fixed": 0}
+    for path in shard_paths():
+        reader = connect(path)
+        try:
+            fixes = []
+            cur = reader.execute(
+                "SELECT user_id, bedtime, waketime, bed_min, wake_min FROM sleep_settings WHERE enabled=1"
+            )
+            for r in cur:
+                bed, wake = minute_of_day(r["bedtime"]), minute_of_day(r["waketime"])
+                out["enabled"] += 1
+                out["bed"] += bed is not None
+                out["wake"] += wake is not None
+                if bed != r["bed_min"] or wake != r["wake_min"]:
+                    fixes.append((bed, wake, r["user_id"]))
+        finally:
+            reader.close()
+        with get_conn(path) as conn:
+            for i in range(0, len(fixes), batch_size):
+                conn.executemany("UPDATE sleep_settings SET bed_min=?, wake_min=? WHERE user_id=?", fixes[i:i + batch_size])
+        out["fixed"] += len(fixes)
+    return out
+
+def due_sleep_users(kind: str, minutes: list[int]) -> list[str]:
+    # kind = "bed" | "wake"; ใช้ partial index ของ enabled=1 อ่านเฉพาะ user ที่ถึงเวลาในนาทีนั้น
+    col = SLEEP_MIN_COLUMN[kind]
+    if not minutes:
+        return []
+    marks = ", ".join("?" * len(minutes))
+    out = []
+    for path in shard_paths():
+        with get_conn(path) as conn:
+            rows = conn.execute(
+                f"SELECT user_id FROM sleep_settings WHERE enabled=1 AND {col} IN ({marks})",
+                list(minutes)
+            ).fetchall()
+        out.extend(r["user_id"] for r in rows)
+    return out
 
 def get_diary_stats(user_id: str):
-    with get_conn() as conn:
-        total = conn.execute(
-            "SELECT COUNT(*) as c FROM diary WHERE user_id=?",
+    with user_conn(user_id) as conn:
+        row = conn.execute(
+            "SELECT total, last_day, streak FROM user_stats WHERE user_id=?",
             (user_id,)
-        ).fetchone()["c"]
-
-        today = date.today().isoformat()
-        row_today = conn.execute(
-            "SELECT COUNT(*) as c FROM diary WHERE user_id=? AND day=?",
-            (user_id, today)
         ).fetchone()
-        did_today = 1 if row_today["c"] > 0 else 0
-
-        streak = 0
-        d = date.today()
-        while True:
-            ds = d.isoformat()
-            r = conn.execute(
-                "SELECT COUNT(*) as c FROM diary WHERE user_id=? AND day=?",
-                (user_id, ds)
-            ).fetchone()
-            if r["c"] > 0:
-                streak += 1
-                d = d - timedelta(days=1)
-            else:
+
+    total = int(row["total"]) if row else 0
+    did_today = 1 if row and row["last_day"] == date.today().isoformat() else 0
+    # สตรีคนับจากวันนี้ย้อนหลัง ถ้าวันนี้ยังไม่บันทึกถือว่าเป็น 0 (เหมือนเดิม)
+    streak = int(row["streak"]) if did_today else 0
+
+    lv = _level_from_total(total)
+    return {
+        "total": total,
+        "streak": streak,
+        "did_today": did_today,
+        "level": lv["level"],
+        "stage": lv["stage"],
+        "in_level": lv["in_level"],
+        "need_for_next": lv["need_for_next"],
+        "to_next": lv["to_next"],
+        "next_need": lv["next_need"],
+    }
+
+# gaps-and-islands: วันที่ติดกัน julianday(day) - row_number จะได้ค่าเท่ากัน
+STREAK_SQL = """
+WITH d AS (
+    SELECT DISTINCT day FROM diary WHERE user_id = :user_id
+),
+g AS (
+    SELECT day, julianday(day) - ROW_NUMBER() OVER (ORDER BY day) AS grp FROM d
+)
+SELECT
+    (SELECT COUNT(*) FROM diary WHERE user_id = :user_id) AS total,
+    MIN(day) AS run_start,
+    MAX(day) AS last_day,
+    COUNT(*) AS streak
+FROM g
+WHERE grp = (SELECT grp FROM g ORDER BY day DESC LIMIT 1)
+"""
+
+def days_from_bits(month: str, bits: int, reverse: bool = False) -> list[str]:
+    days = [f"{month}-{d:02d}" for d in range(1, 32) if bits >> (d - 1) & 1]
+    return days[::-1] if reverse else days
+
+def _archived_days_desc(conn, user_id: str):
+    rows = conn.execute(
+        "SELECT month, day_bits FROM diary_days WHERE user_id=? ORDER BY month DESC",
+        (user_id,)
+    )
+    for r in rows:
+        yield from days_from_bits(r["month"], int(r["day_bits"]), reverse=True)
+
+def compute_diary_stats(user_id: str) -> dict:
+    with user_conn(user_id) as conn:
+        row = conn.execute(STREAK_SQL, {"user_id": user_id}).fetchone()
+        archived = conn.execute(
+            "SELECT COALESCE(SUM(entries), 0) AS n FROM diary_days WHERE user_id=?",
+            (user_id,)
+        ).fetchone()["n"]
+
+        total = int(row["total"]) + int(archived)
+        if row["last_day"] is None:
+            if not archived:
+                return {"total": 0, "last_day": None, "streak": 0}
+            days = list(_archived_days_desc(conn, user_id))
+            return {"total": total, "last_day": days[0], "streak": _streak_ending_at(days)}
+
+        # สตรีคที่ต่อเนื่องย้อนเข้าไปในช่วงที่ archive แล้ว
+        streak = int(row["streak"])
+        expect = (date.fromisoformat(row["run_start"]) - timedelta(days=1)).isoformat()
+        for ds in _archived_days_desc(conn, user_id):
+            if ds > expect:
+                continue
+            if ds != expect:
                 break
+            streak += 1
+            expect = (date.fromisoformat(ds) - timedelta(days=1)).isoformat()
+
+    return {"total": total, "last_day": row["last_day"], "streak": streak}
+
+def read_archived_diary(user_id: str, month: str | None = None) -> list[dict]:
+    sql = "SELECT data FROM diary_archive WHERE user_id=?"
+    params = [user_id]
+    if month:
+        sql += " AND month=?"
+        params.append(month)
+    sql += " ORDER BY month, id"
+    out = []
+    with user_conn(user_id) as conn:
+        for r in conn.execute(sql, params):
+            for line in zlib.decompress(r["data"]).decode("utf-8").splitlines():
+                out.append(json.loads(line))
+    return out
+
+def recompute_user_stats(user_id: str) -> dict:
+    st = compute_diary_stats(user_id)
+    now = datetime.utcnow().isoformat()
+    with user_conn(user_id) as conn:
+        if st["last_day"] is None:
+            conn.execute("DELETE FROM user_stats WHERE user_id=?", (user_id,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_stats(user_id, total, last_day, streak, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, st["total"], st["last_day"], st["streak"], now)
+            )
+        conn.commit()
+    return st
+
+def get_mood_trend(user_id: str, weeks: int = MOOD_TREND_WEEKS) -> dict:
+    # อ่านแค่แถว rollup ของ N สัปดาห์ล่าสุด + เดือนนี้ ไม่ขึ้นกับความยาวประวัติ
+    today = date.today()
+    this_week = today - timedelta(days=today.weekday())
+    starts = [(this_week - timedelta(weeks=i)).isoformat() for i in range(weeks - 1, -1, -1)]
+    month = today.isoformat()[:7]
+    with user_conn(user_id) as conn:
+        rows = conn.execute(
+            "SELECT period, bucket, score_sum, scored, entries FROM mood_rollup "
+            "WHERE user_id=? AND ((period='w' AND bucket>=?) OR (period='m' AND bucket=?))",
+            (user_id, starts[0], month)
+        ).fetchall()
+
+    def point(r):
+        if r is None:
+            return {"avg": None, "entries": 0}
+        return {"avg": round(r["score_sum"] / r["scored"], 2) if r["scored"] else None, "entries": int(r["entries"])}
 
-        lv = _level_from_total(total)
-        return {
-            "total": int(total),
-            "streak": int(streak),
-            "did_today": int(did_today),
-            "level": lv["level"],
-            "stage": lv["stage"],
-            "in_level": lv["in_level"],
-            "need_for_next": lv["need_for_next"],
-            "to_next": lv["to_next"],
-            "next_need": lv["next_need"],
-        }
+    by_week = {r["bucket"]: r for r in rows if r["period"] == "w"}
+    month_row = next((r for r in rows if r["period"] == "m"), None)
+    return {
+        "weeks": [{"week": w, **point(by_week.get(w))} for w in starts],
+        "month": {"month": month, **point(month_row)},
+    }
 
 def get_journal_idx(user_id: str) -> int:
-    with get_conn() as conn:
+    with user_conn(user_id) as conn:
         row = conn.execute("SELECT idx FROM journal_state WHERE user_id=?", (user_id,)).fetchone()
         if not row:
             now = datetime.utcnow().isoformat()
@@ -266,12 +798,78 @@ def get_journal_idx(user_id: str) -> int:
             return 0
         return int(row["idx"])
 
+def _set_journal_idx_tx(conn, user_id: str, idx: int, now: str):
+    conn.execute(
+        "INSERT INTO journal_state(user_id, idx, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET idx=excluded.idx, updated_at=excluded.updated_at",
+        (user_id, idx, now)
+    )
+
+def set_journal_idx_future(user_id: str, idx: int) -> Future:
+    return submit_write(user_id, _set_journal_idx_tx, int(idx), datetime.utcnow().isoformat())
+
 def set_journal_idx(user_id: str, idx: int):
+    set_journal_idx_future(user_id, idx).result()
+
+def add_dead_letter(path: str, payload: str, retry_key: str | None, status: int | None, error: str, attempts: int) -> int:
+    now = datetime.utcnow().isoformat()
+    with control_conn() as conn:
+        cur = conn.execute(
+            "INSERT INTO push_dead_letter(path, payload, retry_key, status, error, attempts, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, payload, retry_key, status, error[:1000], attempts, now)
+        )
+        return cur.lastrowid
+
+def list_dead_letters(limit: int = 100, ids: list[int] | None = None, include_replayed: bool = False) -> list[dict]:
+    sql = "SELECT id, path, payload, retry_key, status, error, attempts, created_at, replayed_at FROM push_dead_letter"
+    where, params = [], []
+    if not include_replayed:
+        where.append("replayed_at IS NULL")
+    if ids:
+        where.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    with control_conn() as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+def mark_dead_letter_replayed(dead_id: int):
     now = datetime.utcnow().isoformat()
-    with get_conn() as conn:
+    with control_conn() as conn:
+        conn.execute("UPDATE push_dead_letter SET replayed_at=? WHERE id=?", (now, dead_id))
+
+def acquire_lease(name: str, holder: str, ttl: float) -> dict | None:
+    # ได้ lease ถ้ายังไม่มีใครถือ, หมดอายุแล้ว หรือเราถือเองอยู่ (ต่ออายุ) คืน None ถ้าคนอื่นถืออยู่
+    now = time.time()
+    conn = control_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT holder, expires_at, last_minute FROM scheduler_lease WHERE name=?", (name,)).fetchone()
+        if row and row["holder"] != holder and row["expires_at"] > now:
+            conn.rollback()
+            return None
         conn.execute(
-            "INSERT INTO journal_state(user_id, idx, updated_at) VALUES (?, ?, ?) "
-            "ON CONFLICT(user_id) DO UPDATE SET idx=excluded.idx, updated_at=excluded.updated_at",
-            (user_id, int(idx), now)
+            "INSERT INTO scheduler_lease(name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at",
+            (name, holder, now + ttl)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"holder": holder, "expires_at": now + ttl, "last_minute": row["last_minute"] if row else None}
+
+def set_lease_progress(name: str, holder: str, last_minute: str) -> bool:
+    with control_conn() as conn:
+        cur = conn.execute(
+            "UPDATE scheduler_lease SET last_minute=? WHERE name=? AND holder=?",
+            (last_minute, name, holder)
         )
-        conn.commit()
\ No newline at end of file
+        return cur.rowcount == 1
+
+def release_lease(name: str, holder: str):
+    with control_conn() as conn:
+        conn.execute("UPDATE scheduler_lease SET expires_at=0 WHERE name=? AND holder=?", (name, holder))
@@ -0,0 +1,157 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+# group commit: รวม write จากหลาย request เป็น transaction เดียว (fsync ครั้งเดียว)
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BATCH_MS = float(os.getenv("DB_WRITE_BATCH_MS", "5"))
+DB_WRITE_BATCH_ROWS = int(os.getenv("DB_WRITE_BATCH_ROWS", "200"))
+
+_q: queue.Queue = queue.Queue()
+_thread: threading.Thread | None = None
+_connect = None
+_stats = {"batches": 0, "writes": 0, "failed": 0, "max_batch": 0}
+
+
+def is_running() -> bool:
+    return _thread is not None and _thread.is_alive()
+
+
+def start(connect):
+    # connect(path) -> sqlite3.Connection (สร้างใหม่ใน thread ของ writer เอง)
+    global _thread, _connect
+    if _thread is not None:
+        return
+    _connect = connect
+    _thread = threading.Thread(target=_run, name="db-writer", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 10.0):
+    global _thread
+    if _thread is None:
+        return
+    _q.put(None)
+    _thread.join(timeout)
+    if _thread.is_alive():
+        # ยังเขียนค้างอยู่: อย่าทิ้ง _thread ไม่งั้นงานที่ส่งตามมาจะไม่มีใครรับ
+        log.warning("db writer did not stop within %ss", timeout)
+        return
+    _thread = None
+    # งานที่เข้าคิวหลัง sentinel ไม่มีใครเขียนแล้ว ให้ caller ได้ error แทนรอค้าง
+    leftover = []
+    while True:
+        try:
+            item = _q.get_nowait()
+        except queue.Empty:
+            break
+        if item is not None:
+            leftover.append(item)
+    if leftover:
+        _fail(leftover, RuntimeError("db writer stopped"))
+
+
+def submit(path: str, fn, *args) -> Future:
+    # fn(conn, *args) ทำงานใน transaction ของ batch ห้าม commit เอง
+    fut = Future()
+    _q.put((path, fn, args, fut))
+    return fut
+
+
+def _collect() -> tuple[list, bool]:
+    first = _q.get()
+    if first is None:
+        return [], True
+    batch = [first]
+    deadline = time.monotonic() + DB_WRITE_BATCH_MS / 1000
+    while len(batch) < DB_WRITE_BATCH_ROWS:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            item = _q.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+def _fail(items: list, e: Exception):
+    for _, _, _, fut in items:
+        if not fut.done():
+            fut.set_exception(e)
+    _stats["failed"] += len(items)
+
+
+def _apply(conn, items: list):
+    results = []
+    try:
+        # BEGIN อยู่ใน try: DB ถูก lock นานเกิน busy_timeout ต้องไม่ทำให้ thread ของ writer ตาย
+        conn.execute("BEGIN IMMEDIATE")
+        for _, fn, args, fut in items:
+            # savepoint ต่อ write: อันที่พังไม่ลาก write อื่นใน batch พังไปด้วย
+            conn.execute("SAVEPOINT w")
+            try:
+                res = fn(conn, *args)
+                conn.execute("RELEASE w")
+                results.append((fut, res, None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO w")
+                conn.execute("RELEASE w")
+                results.append((fut, None, e))
+        conn.commit()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        _fail(items, e)
+        log.exception("group commit failed")
+        return
+
+    for fut, res, err in results:
+        if err is not None:
+            _stats["failed"] += 1
+            fut.set_exception(err)
+        else:
+            fut.set_result(res)
+
+
+def _run():
+    conns = {}
+    stopping = False
+    while not stopping:
+        batch, stopping = _collect()
+        if not batch:
+            continue
+        _stats["batches"] += 1
+        _stats["writes"] += len(batch)
+        _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+
+        by_path: dict[str, list] = {}
+        for item in batch:
+            by_path.setdefault(item[0], []).append(item)
+        for path, items in by_path.items():
+            # shard ที่พังไม่ลากงานของ shard อื่นใน batch เดียวกัน
+            try:
+                conn = conns.get(path)
+                if conn is None:
+                    conn = conns[path] = _connect(path)
+                _apply(conn, items)
+            except Exception as e:
+                _fail(items, e)
+                log.exception("db writer failed on %s", path)
+
+    for conn in conns.values():
+        conn.close()
+
+
+def writer_stats() -> dict:
+    return {"enabled": is_running(), "pending": _q.qsize(), **_stats}
@@ -0,0 +1,129 @@
+import os
+import asyncio
+import logging
+import zlib
+
+log = logging.getLogger(__name__)
+
+# โหมดตอบ 200 ให้ LINE ก่อน แล้วค่อยประมวลผล event ใน worker เบื้องหลัง
+WEBHOOK_ACK_FIRST = os.getenv("WEBHOOK_ACK_FIRST", "0") == "1"
+EVENT_WORKERS = max(1, int(os.getenv("EVENT_WORKERS", "4")))
+EVENT_QUEUE_SIZE = max(1, int(os.getenv("EVENT_QUEUE_SIZE", "1000")))
+# reject = ตอบ 503 ทั้ง batch (ให้ LINE redelivery ส่งซ้ำ), drop = ทิ้ง event ที่ล้นแล้ว log ไว้
+EVENT_QUEUE_OVERFLOW = os.getenv("EVENT_QUEUE_OVERFLOW", "reject")
+# จำนวน user ที่ประมวลผลพร้อมกันได้ใน batch เดียว (โหมดประมวลผลใน request)
+EVENT_CONCURRENCY = max(1, int(os.getenv("EVENT_CONCURRENCY", "8")))
+
+_queues: list[asyncio.Queue] = []
+_workers: list[asyncio.Task] = []
+_handler = None
+_stats = {"enqueued": 0, "processed": 0, "failed": 0, "rejected": 0, "dropped": 0}
+
+
+def _shard(user_id: str) -> int:
+    # user เดียวกันลงคิวเดียวกันเสมอ ลำดับ event ของแต่ละคนจึงไม่สลับกัน
+    return zlib.crc32(user_id.encode("utf-8")) % len(_queues)
+
+
+async def _worker(q: asyncio.Queue):
+    while True:
+        ev = await q.get()
+        try:
+            await _handler(ev)
+            _stats["processed"] += 1
+        except Exception:
+            _stats["failed"] += 1
+            log.exception("event handler failed")
+        finally:
+            q.task_done()
+
+
+def is_running() -> bool:
+    return bool(_workers)
+
+
+def start_workers(handler):
+    global _handler
+    if _workers:
+        return
+    _handler = handler
+    per_queue = max(1, EVENT_QUEUE_SIZE // EVENT_WORKERS)
+    for _ in range(EVENT_WORKERS):
+        q = asyncio.Queue(maxsize=per_queue)
+        _queues.append(q)
+        _workers.append(asyncio.create_task(_worker(q)))
+
+
+async def stop_workers(timeout: float = 10.0):
+    if not _workers:
+        return
+    try:
+        await asyncio.wait_for(asyncio.gather(*(q.join() for q in _queues)), timeout)
+    except asyncio.TimeoutError:
+        log.warning("event queue not drained on shutdown: %s", queue_depth())
+    for t in _workers:
+        t.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queues.clear()
+
+
+def enqueue_batch(items: list[tuple[str, dict]]) -> bool:
+    # items = [(user_id, event), ...]
+    # เช็คที่ว่างก่อนใส่ทั้ง batch (ไม่มี await คั่น จึงไม่มี coroutine อื่นแทรก)
+    need = [0] * len(_queues)
+    for user_id, _ in items:
+        need[_shard(user_id)] += 1
+    fits = all(q.maxsize - q.qsize() >= n for q, n in zip(_queues, need))
+
+    if not fits:
+        if EVENT_QUEUE_OVERFLOW == "drop":
+            for user_id, ev in items:
+                q = _queues[_shard(user_id)]
+                if q.full():
+                    _stats["dropped"] += 1
+                    log.warning("event queue full, dropped %s event for %s", ev.get("type"), user_id)
+                else:
+                    q.put_nowait(ev)
+                    _stats["enqueued"] += 1
+            return True
+        _stats["rejected"] += len(items)
+        return False
+
+    for user_id, ev in items:
+        _queues[_shard(user_id)].put_nowait(ev)
+        _stats["enqueued"] += 1
+    return True
+
+
+async def run_per_user(items: list[tuple[str, dict]], handler, limit: int = EVENT_CONCURRENCY):
+    # แยก event ตาม user: ต่าง user รันพร้อมกัน, user เดียวกันรันตามลำดับเดิม
+    groups: dict[str, list[dict]] = {}
+    for user_id, ev in items:
+        groups.setdefault(user_id, []).append(ev)
+
+    sem = asyncio.Semaphore(limit)
+
+    async def _run(evs: list[dict]):
+        async with sem:
+            for ev in evs:
+                await handler(ev)
+
+    results = await asyncio.gather(*(_run(evs) for evs in groups.values()), return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            raise r
+
+
+def queue_depth() -> dict:
+    sizes = [q.qsize() for q in _queues]
+    return {
+        "enabled": WEBHOOK_ACK_FIRST,
+        "workers": len(_workers),
+        "depth": sum(sizes),
+        "capacity": sum(q.maxsize for q in _queues),
+        "per_worker": sizes,
+        "overflow": EVENT_QUEUE_OVERFLOW,
+        "concurrency": EVENT_CONCURRENCY,
+        **_stats,
+    }
@@ -0,0 +1,143 @@
+import io
+import os
+import csv
+import sys
+import json
+import zlib
+import heapq
+import argparse
+
+from dotenv import load_dotenv
+
+import db
+
+load_dotenv()
+
+# export diary (รวมคะแนน mood) แบบ stream: อ่านทีละแถวจาก cursor แล้วเขียนออกเป็นก้อน ไม่โหลดทั้งหมดเข้า memory
+# ใช้ connection ของตัวเองต่อ export (StreamingResponse อาจดึงแต่ละก้อนจากคนละ thread)
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN", "")
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+FIELDS = ("id", "user_id", "day", "score", "text", "created_at")
+FORMATS = ("csv", "jsonl")
+
+
+def _where(user_id: str | None, since: str | None, until: str | None, col: str):
+    # since/until = YYYY-MM-DD รวมทั้งสองฝั่ง; col = คอลัมน์ที่ใช้กรอง (day หรือ month)
+    sql, params = [], []
+    if user_id:
+        sql.append("user_id=?")
+        params.append(user_id)
+    if since:
+        sql.append(f"{col}>=?")
+        params.append(since if col == "day" else since[:7])
+    if until:
+        sql.append(f"{col}<=?")
+        params.append(until if col == "day" else until[:7])
+    return (" WHERE " + " AND ".join(sql) if sql else ""), params
+
+
+def _iter_hot(conn, user_id, since, until):
+    where, params = _where(user_id, since, until, "day")
+    cur = conn.execute(
+        f"SELECT id, user_id, day, score, text, created_at FROM diary{where} ORDER BY user_id, day, id",
+        params
+    )
+    for r in cur:
+        yield (r["user_id"], r["day"], r["id"]), dict(r)
+
+
+def _iter_archived(conn, user_id, since, until):
+    where, params = _where(user_id, since, until, "month")
+    cur = conn.execute(f"SELECT user_id, data FROM diary_archive{where} ORDER BY user_id, month, id", params)
+    for r in cur:
+        # คลายทีละก้อน (ผู้ใช้ 1 คน x 1 เดือน)
+        for line in zlib.decompress(r["data"]).decode("utf-8").splitlines():
+            row = json.loads(line)
+            if since and row["day"] < since or until and row["day"] > until:
+                continue
+            row["user_id"] = r["user_id"]
+            yield (row["user_id"], row["day"], row["id"]), row
+
+
+def iter_rows(user_id: str | None = None, since: str | None = None, until: str | None = None, paths=None):
+    # เรียงตาม (user_id, day, id) ภายในแต่ละ shard; ถ้าระบุ user อ่านแค่ shard ของ user นั้น
+    if paths is None:
+        paths = [db.user_db_path(user_id)] if user_id else db.shard_paths()
+    for path in paths:
+        conn = db.connect(path, check_same_thread=False)
+        try:
+            merged = heapq.merge(
+                _iter_archived(conn, user_id, since, until),
+                _iter_hot(conn, user_id, since, until),
+                key=lambda kv: kv[0],
+            )
+            for _, row in merged:
+                yield row
+        finally:
+            conn.close()
+
+
+def iter_csv(rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(FIELDS)
+    for row in rows:
+        w.writerow([row.get(f) for f in FIELDS])
+        if buf.tell() >= EXPORT_CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def iter_jsonl(rows):
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps({f: row.get(f) for f in FIELDS}, ensure_ascii=False) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(parts).encode("utf-8")
+            parts.clear()
+            size = 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+
+def gzip_chunks(chunks, level: int = 6):
+    # wbits=31 = gzip header/trailer บีบอัดต่อเนื่องทีละก้อน
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def export(fmt: str = "csv", compress: bool = False, **filters):
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    rows = iter_rows(**filters)
+    chunks = iter_csv(rows) if fmt == "csv" else iter_jsonl(rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Stream diary entries (text + mood score) as CSV or JSONL")
+    ap.add_argument("--user", default=None, help="export one user only (default: all users)")
+    ap.add_argument("--since", default=None, help="first day, YYYY-MM-DD")
+    ap.add_argument("--until", default=None, help="last day, YYYY-MM-DD")
+    ap.add_argument("--format", choices=FORMATS, default="csv")
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    args = ap.parse_args()
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export(args.format, args.gzip, user_id=args.user, since=args.since, until=args.until):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
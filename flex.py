@@ -97,6 +97,13 @@ def tree_progress_flex(stats: dict):
                 {"type": "separator"},
                 {"type": "text", "text": "อยากบันทึกอีกครั้ง พิมพ์มาได้เลย หรือกดเมนูบันทึกอีกที 🌿", "size": "sm", "wrap": True, "color": "#333333"}
             ]
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {"type": "button", "style": "link", "height": "sm", "action": {"type": "postback", "label": "📈 ดูกราฟอารมณ์", "data": "action=mood_trend"}}
+            ]
         }
     }
     if img:
@@ -109,6 +116,62 @@ def tree_progress_flex(stats: dict):
         }
     return {"type": "flex", "altText": "ต้นไม้เติบโตขึ้นแล้ว", "contents": bubble}
 
+def _mood_bar(avg: float | None) -> dict:
+    # แท่งแนวนอน: กว้างตามค่าเฉลี่ย 1-5 บนพื้นเทา
+    pct = 0 if avg is None else max(4, round(avg / 5 * 100))
+    return {
+        "type": "box",
+        "layout": "vertical",
+        "flex": 1,
+        "height": "12px",
+        "backgroundColor": "#EEEEEE",
+        "cornerRadius": "6px",
+        "contents": [
+            {"type": "box", "layout": "vertical", "width": f"{pct}%", "height": "12px",
+             "backgroundColor": "#7BC47F", "cornerRadius": "6px", "contents": [{"type": "filler"}]}
+        ]
+    }
+
+def mood_trend_flex(trend: dict):
+    # trend = ผลจาก db.get_mood_trend: {"weeks": [...], "month": {...}}
+    rows = []
+    for w in trend["weeks"]:
+        d = w["week"]
+        avg = w["avg"]
+        rows.append({
+            "type": "box",
+            "layout": "horizontal",
+            "spacing": "sm",
+            "alignItems": "center",
+            "contents": [
+                {"type": "text", "text": f"{d[8:10]}/{d[5:7]}", "size": "xs", "color": "#888888", "flex": 0},
+                _mood_bar(avg),
+                {"type": "text", "text": "-" if avg is None else f"{avg:.1f}", "size": "xs", "flex": 0, "align": "end"},
+            ]
+        })
+
+    m = trend["month"]
+    month_text = "เดือนนี้ยังไม่มีคะแนน" if m["avg"] is None else f"เดือนนี้เฉลี่ย {m['avg']:.1f}/5 จาก {m['entries']} บันทึก"
+    return {
+        "type": "flex",
+        "altText": "กราฟอารมณ์รายสัปดาห์",
+        "contents": {
+            "type": "bubble",
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "spacing": "md",
+                "contents": [
+                    {"type": "text", "text": "📈 อารมณ์รายสัปดาห์", "weight": "bold", "size": "xl"},
+                    {"type": "text", "text": "คะแนนความสุขเฉลี่ย (1-5) ต่อสัปดาห์", "size": "sm", "color": "#555555"},
+                    *rows,
+                    {"type": "separator"},
+                    {"type": "text", "text": month_text, "size": "sm", "wrap": True}
+                ]
+            }
+        }
+    }
+
 def todo_menu_flex():
     return {
         "type": "flex",
@@ -130,9 +193,13 @@ def todo_menu_flex():
         }
     }
 
-def todo_list_flex(todos: list[dict]):
+def todo_list_flex(page: dict):
+    # page = ผลจาก db.list_todo: {"items", "older", "newer"}
+    todos = page["items"]
+    # ติ๊กแล้วกลับมาหน้าเดิม: หน้านี้เริ่มที่ id ก่อน todos[0]["id"] + 1
+    anchor = f"&from={todos[0]['id'] + 1}" if page.get("newer") else ""
     rows = []
-    for t in todos[:10]:
+    for t in todos:
         status = t.get("status", "todo")
         label = "✅ done" if status == "done" else "⬜ todo"
         rows.append({
@@ -142,13 +209,13 @@ def todo_list_flex(todos: list[dict]):
             "contents": [
                 {"type": "text", "text": label, "size": "sm", "flex": 0},
                 {"type": "text", "text": str(t.get("title", "")), "size": "sm", "wrap": True, "flex": 1},
-                {"type": "button", "style": "link", "height": "sm", "action": {"type": "postback", "label": "ติ๊ก", "data": f"todo_done={t.get('id')}"}}
+                {"type": "button", "style": "link", "height": "sm", "action": {"type": "postback", "label": "ติ๊ก", "data": f"todo_done={t.get('id')}{anchor}"}}
             ]
         })
     if not rows:
         rows = [{"type": "text", "text": "ยังไม่มีงานเลย ลองกด ‘เพิ่มงาน’ ดูนะ", "wrap": True, "size": "sm"}]
 
-    return {
+    msg = {
         "type": "flex",
         "altText": "รายการ To-do",
         "contents": {
@@ -159,6 +226,14 @@ def todo_list_flex(todos: list[dict]):
             ]}
         }
     }
+    nav = []
+    if page.get("newer"):
+        nav.append({"type": "button", "style": "secondary", "height": "sm", "action": {"type": "postback", "label": "◀ ใหม่กว่า", "data": f"action=todo_page&after={page['newer']}"}})
+    if page.get("older"):
+        nav.append({"type": "button", "style": "secondary", "height": "sm", "action": {"type": "postback", "label": "เก่ากว่า ▶", "data": f"action=todo_page&before={page['older']}"}})
+    if nav:
+        msg["contents"]["footer"] = {"type": "box", "layout": "horizontal", "spacing": "sm", "contents": nav}
+    return msg
 
 def sleep_menu_flex(bedtime, waketime, enabled):
     enabled = int(enabled or 0)
@@ -1,21 +1,104 @@
 import os
-import requests
+import json
+import threading
+
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
 
 LINE_ACCESS_TOKEN = os.environ["LINE_CHANNEL_ACCESS_TOKEN"]
 
-def line_reply(reply_token: str, messages: list[dict]):
-    url = "https://api.line.me/v2/bot/message/reply"
-    headers = {"Authorization": f"Bearer {LINE_ACCESS_TOKEN}", "Content-Type": "application/json"}
-    payload = {"replyToken": reply_token, "messages": messages}
-    r = requests.post(url, headers=headers, json=payload, timeout=15)
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me").rstrip("/")
+LINE_DATA_API_BASE = os.getenv("LINE_DATA_API_BASE", "https://api-data.line.me").rstrip("/")
+
+# connection pool ใช้ร่วมกันทั้ง process (keep-alive ไม่ต้อง handshake TLS ใหม่ทุกครั้ง)
+LINE_MAX_CONNECTIONS = int(os.getenv("LINE_MAX_CONNECTIONS", "20"))
+LINE_MAX_KEEPALIVE = int(os.getenv("LINE_MAX_KEEPALIVE", "10"))
+LINE_KEEPALIVE_EXPIRY = float(os.getenv("LINE_KEEPALIVE_EXPIRY", "30"))
+LINE_TIMEOUT = float(os.getenv("LINE_TIMEOUT", "15"))
+
+# LINE multicast รับผู้รับได้สูงสุด 500 คนต่อ request
+LINE_MULTICAST_MAX = min(500, int(os.getenv("LINE_MULTICAST_MAX", "500")))
+
+_async_client: httpx.AsyncClient | None = None
+_sync_client: httpx.Client | None = None
+_sync_lock = threading.Lock()
+
+
+def _headers(content_type: str | None = "application/json") -> dict:
+    headers = {"Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}
+    if content_type:
+        headers["Content-Type"] = content_type
+    return headers
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LINE_MAX_CONNECTIONS,
+        max_keepalive_connections=LINE_MAX_KEEPALIVE,
+        keepalive_expiry=LINE_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            base_url=LINE_API_BASE,
+            headers=_headers(),
+            limits=_limits(),
+            timeout=LINE_TIMEOUT,
+        )
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    # สำหรับโค้ดที่รันใน thread (APScheduler) หรือสคริปต์ CLI
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(
+                base_url=LINE_API_BASE,
+                headers=_headers(),
+                limits=_limits(),
+                timeout=LINE_TIMEOUT,
+            )
+        return _sync_client
+
+
+async def aclose():
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    with _sync_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_body(head: dict, messages: list) -> bytes:
+    # message ที่เป็น bytes คือ JSON ที่ serialize ไว้แล้ว (render_cache) ต่อเข้าไปตรงๆ
+    parts = [m if isinstance(m, bytes) else _dumps(m) for m in messages]
+    return _dumps(head)[:-1] + b',"messages":[' + b",".join(parts) + b"]}"
+
+
+async def line_reply(reply_token: str, messages: list):
+    body = encode_body({"replyToken": reply_token}, messages)
+    r = await get_async_client().post("/v2/bot/message/reply", content=body)
     r.raise_for_status()
 
-def line_push(user_id: str, messages: list[dict]):
-    url = "https://api.line.me/v2/bot/message/push"
-    headers = {"Authorization": f"Bearer {LINE_ACCESS_TOKEN}", "Content-Type": "application/json"}
-    payload = {"to": user_id, "messages": messages}
-    r = requests.post(url, headers=headers, json=payload, timeout=15)
-    r.raise_for_status()
\ No newline at end of file
+
+def multicast_batches(user_ids: list[str], size: int = LINE_MULTICAST_MAX) -> list[list[str]]:
+    return [user_ids[i:i + size] for i in range(0, len(user_ids), size)]
+
+
+def line_api_sync(method: str, path: str, **kwargs) -> httpx.Response:
+    r = get_sync_client().request(method, path, **kwargs)
+    r.raise_for_status()
+    return r
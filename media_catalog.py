@@ -0,0 +1,91 @@
+import os
+import json
+import random
+import threading
+from pathlib import Path
+
+# แคตตาล็อกเพลง/คลิป โหลดจากไฟล์ JSON ครั้งเดียว แล้วสร้าง index/หน้าไว้ล่วงหน้า
+MEDIA_CATALOG_PATH = Path(os.getenv(
+    "MEDIA_CATALOG_PATH",
+    str(Path(__file__).resolve().parent / "data" / "media_catalog.json"),
+))
+MEDIA_PAGE_SIZE = int(os.getenv("MEDIA_PAGE_SIZE", "10"))
+
+_lock = threading.Lock()
+_groups: dict[str, tuple[tuple[str, str], ...]] | None = None
+_categories: dict[str, dict] = {}
+_cat_to_group: dict[str, str] = {}
+
+
+def load(path: Path | None = None):
+    global _groups, _categories, _cat_to_group
+    with open(path or MEDIA_CATALOG_PATH, encoding="utf-8") as f:
+        raw = json.load(f)
+
+    groups = {g: tuple((c, label) for c, label in entries) for g, entries in raw["groups"].items()}
+
+    cat_to_group = {}
+    for g, entries in groups.items():
+        if g == "root":
+            continue
+        for c, _ in entries:
+            cat_to_group.setdefault(c, g)
+
+    categories = {}
+    for c, v in raw["categories"].items():
+        items = tuple(v["items"])
+        pages = tuple(items[i:i + MEDIA_PAGE_SIZE] for i in range(0, len(items), MEDIA_PAGE_SIZE)) or ((),)
+        categories[c] = {"title": v["title"], "items": items, "pages": pages}
+
+    with _lock:
+        _categories = categories
+        _cat_to_group = cat_to_group
+        _groups = groups
+
+
+def _ensure_loaded():
+    if _groups is None:
+        load()
+
+
+def groups() -> dict[str, tuple[tuple[str, str], ...]]:
+    _ensure_loaded()
+    return _groups
+
+
+def is_group(key: str) -> bool:
+    _ensure_loaded()
+    return key in _groups and key != "root"
+
+
+def has_category(cat: str) -> bool:
+    _ensure_loaded()
+    return cat in _categories
+
+
+def title(cat: str) -> str:
+    _ensure_loaded()
+    return _categories[cat]["title"]
+
+
+def page_count(cat: str) -> int:
+    _ensure_loaded()
+    return len(_categories[cat]["pages"])
+
+
+def page_items(cat: str, page: int) -> tuple[dict, ...]:
+    _ensure_loaded()
+    return _categories[cat]["pages"][page]
+
+
+def clamp_page(cat: str, page: int) -> int:
+    return max(0, min(int(page), page_count(cat) - 1))
+
+
+def random_page(cat: str) -> int:
+    return random.randrange(page_count(cat))
+
+
+def group_of(cat: str) -> str | None:
+    _ensure_loaded()
+    return _cat_to_group.get(cat)
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+
+import httpx
+
+import db
+from line_api import get_sync_client, encode_body
+
+log = logging.getLogger(__name__)
+
+# ส่ง push/multicast ผ่าน token bucket ต่อ endpoint + retry แบบ exponential backoff (full jitter)
+# ส่งไม่ได้จริงๆ เก็บลง push_dead_letter แล้ว replay ด้วย `python push_delivery.py replay`
+# ค่า default ตั้งไว้ราวครึ่งหนึ่งของ quota ของ LINE (push 2,000 req/s, multicast 200 req/s)
+LINE_PUSH_RATE = float(os.getenv("LINE_PUSH_RATE", "1000"))
+LINE_MULTICAST_RATE = float(os.getenv("LINE_MULTICAST_RATE", "100"))
+LINE_RATE_BURST = float(os.getenv("LINE_RATE_BURST", "20"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", "6"))
+PUSH_BACKOFF_BASE = float(os.getenv("PUSH_BACKOFF_BASE", "0.5"))
+PUSH_BACKOFF_MAX = float(os.getenv("PUSH_BACKOFF_MAX", "30"))
+
+PUSH_PATH = "/v2/bot/message/push"
+MULTICAST_PATH = "/v2/bot/message/multicast"
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # บล็อกจนได้ token 1 อัน (เรียกจาก thread ของ scheduler/CLI เท่านั้น)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {
+    PUSH_PATH: TokenBucket(LINE_PUSH_RATE, LINE_RATE_BURST),
+    MULTICAST_PATH: TokenBucket(LINE_MULTICAST_RATE, LINE_RATE_BURST),
+}
+_stats = {"sent": 0, "retries": 0, "dead": 0, "rate_limited": 0}
+_stats_lock = threading.Lock()
+
+
+def _inc(key: str):
+    # send() ถูกเรียกจากหลาย thread ของ APScheduler/CLI พร้อมกัน
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _retryable(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(PUSH_BACKOFF_MAX, PUSH_BACKOFF_BASE * 2 ** attempt))
+
+
+def send(path: str, head: dict, messages: list, retry_key: str | None = None) -> bool:
+    # True = LINE รับแล้ว, False = ลง dead-letter แล้ว (ไม่ raise ให้ caller)
+    # X-Line-Retry-Key เดิมทุก attempt: ถ้าครั้งก่อนถึง LINE แล้วจะได้ 409 แทนการส่งซ้ำ
+    body = encode_body(head, messages)
+    retry_key = retry_key or str(uuid.uuid4())
+    bucket = _buckets.get(path)
+    status = None
+    error = ""
+    for attempt in range(1, PUSH_MAX_ATTEMPTS + 1):
+        if bucket is not None:
+            bucket.acquire()
+        delay = None
+        try:
+            r = get_sync_client().post(path, content=body, headers={"X-Line-Retry-Key": retry_key})
+            status = r.status_code
+            if r.is_success or status == 409:
+                _inc("sent")
+                return True
+            error = r.text
+            if not _retryable(status):
+                break
+            if status == 429:
+                _inc("rate_limited")
+                delay = _retry_after(r)
+        except httpx.TransportError as e:
+            status = None
+            error = f"{type(e).__name__}: {e}"
+
+        if attempt == PUSH_MAX_ATTEMPTS:
+            break
+        _inc("retries")
+        time.sleep(max(delay or 0, _backoff(attempt)))
+
+    _inc("dead")
+    dead_id = db.add_dead_letter(path, body.decode("utf-8"), retry_key, status, error, attempt)
+    log.error("LINE %s failed (status=%s), dead-lettered as #%d: %s", path, status, dead_id, error[:200])
+    return False
+
+
+def multicast(user_ids: list[str], messages: list) -> bool:
+    return send(MULTICAST_PATH, {"to": user_ids}, messages)
+
+
+def replay(ids: list[int] | None = None, limit: int = 100) -> dict:
+    done = failed = 0
+    for row in db.list_dead_letters(limit=limit, ids=ids):
+        payload = json.loads(row["payload"])
+        messages = payload.pop("messages")
+        # dead-letter ใหม่ (ถ้าพังอีก) เป็นแถวใหม่ แถวเดิมถือว่าจัดการแล้ว
+        ok = send(row["path"], payload, messages, retry_key=row["retry_key"])
+        db.mark_dead_letter_replayed(row["id"])
+        if ok:
+            done += 1
+        else:
+            failed += 1
+    return {"replayed": done, "failed": failed}
+
+
+def delivery_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Inspect and replay dead-lettered LINE pushes")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list", help="show pending dead letters")
+    p_list.add_argument("--limit", type=int, default=50)
+    p_replay = sub.add_parser("replay", help="resend pending dead letters")
+    p_replay.add_argument("--id", type=int, nargs="*", default=None, help="only these ids")
+    p_replay.add_argument("--limit", type=int, default=100)
+    args = ap.parse_args()
+
+    db.init_db()
+    if args.cmd == "list":
+        for row in db.list_dead_letters(limit=args.limit):
+            to = json.loads(row["payload"]).get("to")
+            n = len(to) if isinstance(to, list) else 1
+            print(f"#{row['id']} {row['created_at']} {row['path']} to={n} status={row['status']} "
+                  f"attempts={row['attempts']} {(row['error'] or '')[:80]}")
+    else:
+        res = replay(args.id, args.limit)
+        print(f"Replayed {res['replayed']}, failed again {res['failed']}")
@@ -0,0 +1,36 @@
+import os
+import json
+
+from cache import LRUCache, MISSING
+
+# หน้าจอที่ไม่เคยเปลี่ยน: serialize เป็น JSON bytes ครั้งเดียวแล้วใช้ซ้ำตลอด
+# หน้าจอกึ่งคงที่ (เช่น media ต่อ (cat, page)): เก็บใน LRU
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "512"))
+
+_static: dict = {}
+_pages = LRUCache(RENDER_CACHE_SIZE)
+
+
+def to_json(msg: dict) -> bytes:
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def static(key, build) -> bytes:
+    data = _static.get(key)
+    if data is None:
+        data = to_json(build())
+        _static[key] = data
+    return data
+
+
+def semi_static(key, build) -> list[bytes]:
+    # build() คืน list ของ message; เก็บเป็น list ของ bytes
+    data = _pages.get(key)
+    if data is MISSING:
+        data = [to_json(m) for m in build()]
+        _pages.set(key, data)
+    return data
+
+
+def render_stats() -> dict:
+    return {"static": len(_static), "pages": _pages.stats()}
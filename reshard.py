@@ -0,0 +1,125 @@
+import time
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+
+import db
+
+# ย้ายข้อมูลจาก DB ไฟล์เดียว (หรือ shard ชุดเดิม) ไปเป็น N shard ตาม crc32(user_id)
+# อ่านแบบ stream ทีละตาราง เขียนเป็น batch ไม่โหลดทั้งตารางเข้า memory
+
+USER_TABLES = [
+    "users", "diary", "todo", "sleep_settings", "journal_state", "user_stats",
+    "diary_archive", "diary_days", "mood_rollup",
+]
+# ตารางของทั้งระบบ อยู่ใน control shard (shard 0) เสมอ; scheduler_lease ไม่ต้องย้าย (หมดอายุเองแล้วแย่งใหม่)
+CONTROL_TABLES = ["push_dead_letter"]
+
+
+def _columns(conn, table: str) -> list[str]:
+    return [r["name"] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _autoincrement_column(conn, table: str) -> str | None:
+    # id ที่ AUTOINCREMENT นับแยกกันในแต่ละไฟล์ต้นทาง รวมหลายไฟล์แล้วชนกันได้
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if row is None or "AUTOINCREMENT" not in row["sql"].upper():
+        return None
+    pk = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})").fetchall() if r["pk"]]
+    return pk[0] if len(pk) == 1 else None
+
+
+def _open_source(src_path: Path, copy_path: Path):
+    # shard ปลายทางถูก migrate ตอนยังว่าง backfill (user_stats, mood_rollup, bed_min/wake_min) จึงไม่เจออะไร
+    # ต้นทางที่ schema เก่ากว่า: migrate สำเนาชั่วคราวก่อนอ่าน (ไม่แตะไฟล์ต้นทาง) ให้ตารางที่คำนวณต่อมาครบ
+    src = db.connect(src_path)
+    version = src.execute("PRAGMA user_version").fetchone()[0]
+    if version >= db.MIGRATIONS[-1][0]:
+        return src, None
+    copy = db.connect(copy_path)
+    src.backup(copy)
+    src.close()
+    db.migrate(copy)
+    return copy, version
+
+
+def reshard(sources: list[Path], dest_base: Path, shards: int, batch_size: int = 5000) -> dict:
+    targets = db.shard_paths(dest_base, shards)
+    existing = [p for p in targets if p.exists()]
+    if existing:
+        raise SystemExit(f"destination already exists: {', '.join(map(str, existing))}")
+
+    t0 = time.perf_counter()
+    dest = []
+    for p in targets:
+        conn = db.connect(p)
+        db.migrate(conn)
+        dest.append(conn)
+
+    counts: dict[str, int] = {}
+    migrated: dict[str, int] = {}
+    workdir = tempfile.TemporaryDirectory(prefix="reshard_")
+    for n_src, src_path in enumerate(sources):
+        src, old_version = _open_source(src_path, Path(workdir.name) / f"{n_src}_{src_path.name}")
+        if old_version is not None:
+            migrated[str(src_path)] = old_version
+        src_tables = {r["name"] for r in src.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table in USER_TABLES + CONTROL_TABLES:
+            if table not in src_tables:
+                continue
+            dest_cols = set(_columns(dest[0], table))
+            cols = [c for c in _columns(src, table) if c in dest_cols]
+            if len(sources) > 1:
+                # หลายต้นทาง: ให้ shard ปลายทางออก id ใหม่เอง
+                cols = [c for c in cols if c != _autoincrement_column(dest[0], table)]
+            col_sql = ", ".join(cols)
+            uid_pos = cols.index("user_id") if table in USER_TABLES else None
+            # ปลายทางว่างเสมอ แถวที่ชนกันแปลว่าต้นทางซ้ำกัน ให้หยุดแทนการเขียนทับเงียบๆ
+            insert_sql = f"INSERT INTO {table}({col_sql}) VALUES ({', '.join('?' * len(cols))})"
+
+            pending: list[list] = [[] for _ in range(shards)]
+            n = 0
+            cur = src.execute(f"SELECT {col_sql} FROM {table}")
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    i = 0 if uid_pos is None else db.shard_of(row[uid_pos], shards)
+                    pending[i].append(tuple(row))
+                for i, batch in enumerate(pending):
+                    if batch:
+                        before = dest[i].total_changes
+                        try:
+                            dest[i].executemany(insert_sql, batch)
+                        except sqlite3.IntegrityError as e:
+                            raise SystemExit(f"{src_path}: {table} conflicts with rows already copied: {e}")
+                        dest[i].commit()
+                        n += dest[i].total_changes - before
+                        batch.clear()
+            counts[table] = counts.get(table, 0) + n
+        src.close()
+    workdir.cleanup()
+
+    for conn in dest:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+    return {"shards": [str(p) for p in targets], "rows": counts, "migrated": migrated, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Split a single-file database (or an old shard set) into N hash shards")
+    ap.add_argument("--src", nargs="+", default=[str(db.DB_PATH)], help="source SQLite file(s)")
+    ap.add_argument("--dest", default=str(db.DB_PATH), help="base path for shard files (app.db -> app.0.db, app.1.db, ...)")
+    ap.add_argument("--shards", type=int, required=True, help="number of shards (set DB_SHARDS to the same value)")
+    ap.add_argument("--batch", type=int, default=5000)
+    args = ap.parse_args()
+
+    result = reshard([Path(p) for p in args.src], Path(args.dest), args.shards, args.batch)
+    for path, version in result["migrated"].items():
+        print(f"  {path} was at schema version {version}; copied from a migrated temporary copy")
+    print(f"Wrote {len(result['shards'])} shards in {result['seconds']}s")
+    for table, n in result["rows"].items():
+        print(f"  {table}: {n} rows")
@@ -0,0 +1,110 @@
+import time
+
+# ตาราง route ถูกเติมตอน import (decorator) ครั้งเดียว แล้ว lookup ด้วย dict อย่างเดียว
+POSTBACK_EXACT: dict[str, tuple[str, object]] = {}   # "action=diary"
+POSTBACK_KEY: dict[str, tuple[str, object]] = {}     # "score=3" -> "score"
+POSTBACK_ACTION: dict[str, tuple[str, object]] = {}  # "action=media_cat&cat=..." -> "media_cat"
+TEXT_MODES: dict[str, tuple[str, object]] = {}       # "todo_wait_add"
+TEXT_MODE_PREFIX: dict[str, tuple[str, object]] = {} # "diary_wait_text_score:3" -> "diary_wait_text_score"
+
+_stats: dict[str, dict] = {}
+
+
+def _register(table: dict, key: str, name: str):
+    def deco(fn):
+        if key in table:
+            raise ValueError(f"duplicate route: {name}")
+        table[key] = (name, fn)
+        _stats[name] = {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+        return fn
+    return deco
+
+
+def postback(data: str):
+    return _register(POSTBACK_EXACT, data, f"postback:{data}")
+
+
+def postback_key(key: str):
+    return _register(POSTBACK_KEY, key, f"postback:{key}=*")
+
+
+def postback_action(action: str):
+    return _register(POSTBACK_ACTION, action, f"postback:action={action}&*")
+
+
+def text_mode(mode: str | None):
+    # mode=None คือ fallback ของข้อความที่ไม่ตรงกับ mode ไหนเลย
+    return _register(TEXT_MODES, mode, f"text:{mode or 'default'}")
+
+
+def text_mode_prefix(prefix: str):
+    return _register(TEXT_MODE_PREFIX, prefix, f"text:{prefix}:*")
+
+
+def _action_of(post_data: str) -> str | None:
+    for part in post_data.split("&"):
+        k, _, v = part.partition("=")
+        if k == "action":
+            return v
+    return None
+
+
+def resolve_postback(post_data: str):
+    route = POSTBACK_EXACT.get(post_data)
+    if route:
+        return route
+    key, sep, _ = post_data.partition("=")
+    if sep:
+        route = POSTBACK_KEY.get(key)
+        if route:
+            return route
+    action = _action_of(post_data)
+    if action is not None:
+        return POSTBACK_ACTION.get(action)
+    return None
+
+
+def resolve_text(mode: str | None):
+    route = TEXT_MODES.get(mode)
+    if route:
+        return route
+    if mode:
+        prefix, sep, _ = mode.partition(":")
+        if sep:
+            route = TEXT_MODE_PREFIX.get(prefix)
+            if route:
+                return route
+    return TEXT_MODES.get(None)
+
+
+async def dispatch(route, *args):
+    name, fn = route
+    st = _stats[name]
+    t0 = time.perf_counter()
+    try:
+        await fn(*args)
+    except Exception:
+        st["errors"] += 1
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        st["calls"] += 1
+        st["total_ms"] += ms
+        if ms > st["max_ms"]:
+            st["max_ms"] = ms
+
+
+def route_stats() -> list[dict]:
+    out = []
+    for name, st in _stats.items():
+        calls = st["calls"]
+        out.append({
+            "route": name,
+            "calls": calls,
+            "errors": st["errors"],
+            "avg_ms": round(st["total_ms"] / calls, 3) if calls else 0.0,
+            "max_ms": round(st["max_ms"], 3),
+            "total_ms": round(st["total_ms"], 3),
+        })
+    out.sort(key=lambda r: r["calls"], reverse=True)
+    return out
@@ -1,124 +1,216 @@
 import os
-import requests
+import time
+import uuid
+import signal
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from db import get_sleep_setting, get_sleep_settings
+import push_delivery
+from db import (
+    due_sleep_users, bootstrap_sleep_reminders,
+    acquire_lease, set_lease_progress, release_lease,
+)
+from line_api import multicast_batches
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "").strip()
 if not LINE_CHANNEL_ACCESS_TOKEN:
     raise RuntimeError("Missing LINE_CHANNEL_ACCESS_TOKEN in .env")
 
 BANGKOK_TZ = "Asia/Bangkok"
+TZ = ZoneInfo(BANGKOK_TZ)
 
-scheduler = BackgroundScheduler(timezone=BANGKOK_TZ)
+# tick ที่หลุด (เครื่องค้าง/restart) ส่งย้อนหลังได้ไม่เกินกี่นาที (เท่ากับ misfire_grace_time เดิม 300 วิ)
+SLEEP_CATCHUP_MINUTES = int(os.getenv("SLEEP_CATCHUP_MINUTES", "5"))
+TICK_JOB_ID = "sleep:tick"
+LEASE_JOB_ID = "sleep:lease"
 
+# embedded = รันใน process ของเว็บ (หลาย worker ได้ ส่งเฉพาะ process ที่ถือ lease)
+# standalone = เว็บไม่รัน scheduler ใช้ `python scheduler.py` แยก, off = ไม่ส่งแจ้งเตือนเลย
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "embedded")
+SCHEDULER_LEASE_NAME = "sleep_reminders"
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "45"))
+SCHEDULER_LEASE_RENEW = float(os.getenv("SCHEDULER_LEASE_RENEW", "15"))
 
-def _line_push(user_id: str, messages: list[dict]):
-    headers = {
-        "Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    payload = {"to": user_id, "messages": messages}
-    r = requests.post(
-        "https://api.line.me/v2/bot/message/push",
-        headers=headers,
-        json=payload,
-        timeout=20,
-    )
-    if r.status_code >= 400:
-        raise RuntimeError(f"LINE push failed: {r.status_code} {r.text}")
-
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
-def _job_id(kind: str, user_id: str) -> str:
-    return f"sleep:{kind}:{user_id}"
+scheduler = BackgroundScheduler(timezone=BANGKOK_TZ)
 
+_tick_lock = threading.Lock()
+_last_minute: datetime | None = None
+_leader_until = 0.0
+_stats: dict = {"bootstrap": None, "ticks": 0, "last_tick_ms": None, "last_due": 0, "leader": False}
 
-def _remove_job(job_id: str):
-    try:
-        scheduler.remove_job(job_id)
-    except Exception:
-        pass
+BEDTIME_MESSAGE = {
+    "type": "text",
+    "text": (
+        "🌙 ถึงเวลาเตรียมตัวนอนแล้วนะ 🤍\n"
+        "ลองวางมือถือ 5 นาที หายใจลึกๆ 3 รอบ แล้วค่อยเข้านอน\n"
+        "ถ้าเครียดมาก โทร 1323 ได้เลย"
+    ),
+}
 
+WAKETIME_MESSAGE = {
+    "type": "text",
+    "text": (
+        "☀️ ได้เวลาตื่นแล้วนะ 🤍\n"
+        "ดื่มน้ำ 1 แก้ว + ยืดตัวเบาๆ 30 วิ\n"
+        "วันนี้ขอให้ใจเบาลงนิดนึงนะ"
+    ),
+}
 
-def _push_bedtime(user_id: str):
-    _line_push(user_id, [{
-        "type": "text",
-        "text": (
-            "🌙 ถึงเวลาเตรียมตัวนอนแล้วนะ 🤍\n"
-            "ลองวางมือถือ 5 นาที หายใจลึกๆ 3 รอบ แล้วค่อยเข้านอน\n"
-            "ถ้าเครียดมาก โทร 1323 ได้เลย"
-        ),
-    }])
 
+REMINDERS = {"bed": BEDTIME_MESSAGE, "wake": WAKETIME_MESSAGE}
 
-def _push_waketime(user_id: str):
-    _line_push(user_id, [{
-        "type": "text",
-        "text": (
-            "☀️ ได้เวลาตื่นแล้วนะ 🤍\n"
-            "ดื่มน้ำ 1 แก้ว + ยืดตัวเบาๆ 30 วิ\n"
-            "วันนี้ขอให้ใจเบาลงนิดนึงนะ"
-        ),
-    }])
 
+def _now_minute() -> datetime:
+    return datetime.now(TZ).replace(second=0, microsecond=0)
 
-def _schedule_one(user_id: str):
-    s = get_sleep_setting(user_id)
-    enabled = int(s.get("enabled", 0) or 0)
 
-    bed_id = _job_id("bed", user_id)
-    wake_id = _job_id("wake", user_id)
+def _is_leader() -> bool:
+    # เผื่อเวลาไว้ 1 รอบต่ออายุ: ถ้าต่อไม่ทัน หยุดส่งก่อน lease หมดจริง
+    return time.monotonic() < _leader_until - SCHEDULER_LEASE_RENEW
 
-    _remove_job(bed_id)
-    _remove_job(wake_id)
 
-    if enabled != 1:
+def _renew_lease() -> bool:
+    global _leader_until, _last_minute
+    was_leader = _stats["leader"]
+    started = time.monotonic()
+    try:
+        lease = acquire_lease(SCHEDULER_LEASE_NAME, HOLDER, SCHEDULER_LEASE_TTL)
+    except Exception:
+        log.exception("scheduler lease renewal failed")
+        lease = None
+
+    if lease is None:
+        _leader_until = 0.0
+        _stats["leader"] = False
+        if was_leader:
+            log.warning("lost scheduler lease, %s stops sending reminders", HOLDER)
+        return False
+
+    _leader_until = started + SCHEDULER_LEASE_TTL
+    _stats["leader"] = True
+    if not was_leader:
+        # เพิ่งได้เป็น leader: ทำต่อจากนาทีที่ leader คนก่อนส่งไว้ (ภายใน SLEEP_CATCHUP_MINUTES)
+        with _tick_lock:
+            if lease["last_minute"]:
+                _last_minute = datetime.fromisoformat(lease["last_minute"])
+        log.info("%s is now the reminder scheduler leader", HOLDER)
+        bootstrap()
+    return True
+
+
+def _dispatch_minutes(minutes: list[int]) -> int:
+    # ข้อความแจ้งเตือนเหมือนกันทุกคน: รวม user ที่ถึงเวลาเป็น multicast ก้อนละ 500 แทน push ทีละคน
+    due = 0
+    for kind, message in REMINDERS.items():
+        user_ids = list(dict.fromkeys(due_sleep_users(kind, minutes)))
+        due += len(user_ids)
+        for batch in multicast_batches(user_ids):
+            # rate limit/retry/dead-letter อยู่ใน push_delivery ก้อนที่พังไม่ขวางก้อนอื่น
+            if not push_delivery.multicast(batch, [message]):
+                log.warning("sleep %s reminder for %d users went to dead-letter", kind, len(batch))
+    return due
+
+
+def _tick():
+    # ส่งเฉพาะ process ที่ถือ lease; รวมนาทีที่ยังไม่ได้ส่ง ย้อนได้ไม่เกิน SLEEP_CATCHUP_MINUTES
+    global _last_minute
+    if not _is_leader() and not _renew_lease():
         return
-
-    bedtime = s.get("bedtime")
-    waketime = s.get("waketime")
-
-    if bedtime:
-        hh, mm = bedtime.split(":")
-        scheduler.add_job(
-            _push_bedtime,
-            # ✅ FIX: ส่ง timezone ให้ CronTrigger ด้วย ไม่งั้นจะยิงตาม UTC
-            CronTrigger(hour=int(hh), minute=int(mm), timezone=BANGKOK_TZ),
-            id=bed_id,
-            args=[user_id],
-            replace_existing=True,
-            misfire_grace_time=300,
-        )
-
-    if waketime:
-        hh, mm = waketime.split(":")
-        scheduler.add_job(
-            _push_waketime,
-            # ✅ FIX: ส่ง timezone ให้ CronTrigger ด้วย
-            CronTrigger(hour=int(hh), minute=int(mm), timezone=BANGKOK_TZ),
-            id=wake_id,
-            args=[user_id],
-            replace_existing=True,
-            misfire_grace_time=300,
+    now = _now_minute()
+    with _tick_lock:
+        start = now if _last_minute is None else max(
+            _last_minute + timedelta(minutes=1),
+            now - timedelta(minutes=SLEEP_CATCHUP_MINUTES - 1),
         )
+        if start > now:
+            return
+        minutes = []
+        t = start
+        while t <= now:
+            minutes.append(t.hour * 60 + t.minute)
+            t += timedelta(minutes=1)
+        _last_minute = now
+    t0 = time.perf_counter()
+    _stats["last_due"] = _dispatch_minutes(minutes)
+    _stats["ticks"] += 1
+    _stats["last_tick_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    set_lease_progress(SCHEDULER_LEASE_NAME, HOLDER, now.isoformat())
+
+
+def bootstrap() -> dict:
+    t0 = time.perf_counter()
+    res = bootstrap_sleep_reminders()
+    res["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _stats["bootstrap"] = res
+    log.info("sleep reminders ready: %(enabled)d users (bed %(bed)d, wake %(wake)d), fixed %(fixed)d rows in %(ms)sms", res)
+    return res
 
 
 def start_scheduler():
+    # job เดียวทุกนาที อ่าน user ที่ถึงเวลาจาก index bed_min/wake_min แทน CronTrigger 2 ตัวต่อ user
+    # ทุก process ที่เรียกจะแย่ง lease ใน control shard ส่งจริงเฉพาะ leader (รัน --workers N ได้)
+    _renew_lease()
+    scheduler.add_job(
+        _renew_lease,
+        IntervalTrigger(seconds=SCHEDULER_LEASE_RENEW),
+        id=LEASE_JOB_ID,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        _tick,
+        CronTrigger(minute="*", timezone=BANGKOK_TZ),
+        id=TICK_JOB_ID,
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=SLEEP_CATCHUP_MINUTES * 60,
+    )
     if not scheduler.running:
         scheduler.start()
 
-    # โหลดทุก user ที่เปิด enabled=1 แล้วตั้ง job ให้
-    for row in get_sleep_settings():
-        try:
-            _schedule_one(row["user_id"])
-        except Exception:
-            pass
 
+def stop_scheduler():
+    global _leader_until
+    if scheduler.running:
+        scheduler.shutdown(wait=True)
+    if _stats["leader"]:
+        # ปล่อย lease ให้ process อื่นรับต่อได้ทันที ไม่ต้องรอหมดอายุ
+        release_lease(SCHEDULER_LEASE_NAME, HOLDER)
+        _leader_until = 0.0
+        _stats["leader"] = False
+
+
+def scheduler_stats() -> dict:
+    return {"mode": SCHEDULER_MODE, "holder": HOLDER, "running": scheduler.running, **_stats}
+
+
+if __name__ == "__main__":
+    # process แยกสำหรับ SCHEDULER_MODE=standalone: python scheduler.py
+    from db import init_db, close_all
 
-def sync_user(user_id: str):
-    # เรียกหลัง set_sleep ทุกครั้ง เพื่ออัปเดตทันที
-    _schedule_one(user_id)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    init_db()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    start_scheduler()
+    log.info("reminder scheduler running as %s", HOLDER)
+    stop.wait()
+    stop_scheduler()
+    close_all()
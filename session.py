@@ -0,0 +1,133 @@
+import os
+import threading
+import logging
+
+import db
+from cache import LRUCache, MISSING
+
+log = logging.getLogger(__name__)
+
+# เก็บ mode การสนทนาไว้ใน memory; users.mode ใน SQLite ยังเป็นตัวจริง
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "50000"))
+# cache นี้อยู่ใน process เดียว: ถ้ารันหลาย worker (uvicorn --workers N) event ถัดไปของ user
+# อาจไปตก worker อื่นที่ถือ mode เก่าอยู่ จึงปิดไว้เป็นค่า default (อ่าน/เขียน users.mode ตรงทุกครั้ง)
+# เปิดด้วย SESSION_MODE_CACHE=1 เฉพาะตอนรัน process เดียว
+SESSION_MODE_CACHE = os.getenv("SESSION_MODE_CACHE", "0") == "1"
+# 1 = write-behind (รวมเขียนลง DB ทุก SESSION_FLUSH_INTERVAL วินาที), 0 = write-through
+# write-behind ต้องใช้ cache ด้วย (worker อื่นมองไม่เห็นค่าที่ยังไม่ flush)
+SESSION_WRITE_BEHIND = SESSION_MODE_CACHE and os.getenv("SESSION_WRITE_BEHIND", "0") == "1"
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "2"))
+# user_id ที่รู้แล้วว่ามีแถวใน users (ไม่ต้อง INSERT OR IGNORE ซ้ำทุก event)
+KNOWN_USERS_MAX = int(os.getenv("KNOWN_USERS_MAX", "100000"))
+
+_modes = LRUCache(SESSION_MAX_USERS, SESSION_TTL)
+_known = LRUCache(KNOWN_USERS_MAX)
+_dirty: dict[str, str | None] = {}
+_dirty_lock = threading.Lock()
+_stop = threading.Event()
+_flusher: threading.Thread | None = None
+
+
+def is_known(user_id: str) -> bool:
+    return _known.get(user_id) is not MISSING
+
+
+def cached_mode(user_id: str):
+    # คืน MISSING ถ้าไม่อยู่ใน cache หรือปิด cache อยู่ (ไม่แตะ DB)
+    if not SESSION_MODE_CACHE:
+        return MISSING
+    return _modes.get(user_id)
+
+
+def ensure_user(user_id: str):
+    if _known.get(user_id) is not MISSING:
+        return
+    if db.upsert_user(user_id) and SESSION_MODE_CACHE:
+        # เพิ่งสร้างแถวใหม่ mode ยังเป็น NULL แน่นอน
+        _modes.set(user_id, None)
+    _known.set(user_id, True)
+
+
+def warm_known_users():
+    for user_id in reversed(db.recent_user_ids(KNOWN_USERS_MAX)):
+        _known.set(user_id, True)
+
+
+def get_mode(user_id: str) -> str | None:
+    if not SESSION_MODE_CACHE:
+        return db.get_mode(user_id)
+    mode = _modes.get(user_id)
+    if mode is not MISSING:
+        return mode
+    with _dirty_lock:
+        if user_id in _dirty:
+            return _dirty[user_id]
+    mode = db.get_mode(user_id)
+    _modes.set(user_id, mode)
+    return mode
+
+
+def set_mode(user_id: str, mode: str | None):
+    if not SESSION_MODE_CACHE:
+        db.set_mode(user_id, mode)
+        return
+    # ส่วนใหญ่เป็น set_mode(None) ซ้ำๆ ตอนกดเมนู ถ้าค่าเดิมอยู่แล้วไม่ต้องเขียน DB
+    if _modes.get(user_id) == mode:
+        return
+    _modes.set(user_id, mode)
+    if SESSION_WRITE_BEHIND:
+        with _dirty_lock:
+            _dirty[user_id] = mode
+    else:
+        db.set_mode(user_id, mode)
+
+
+def flush():
+    with _dirty_lock:
+        if not _dirty:
+            return
+        pending = list(_dirty.items())
+        _dirty.clear()
+    try:
+        db.set_modes(pending)
+    except Exception:
+        log.exception("session flush failed")
+        with _dirty_lock:
+            for user_id, mode in pending:
+                _dirty.setdefault(user_id, mode)
+
+
+def _flush_loop():
+    while not _stop.wait(SESSION_FLUSH_INTERVAL):
+        flush()
+
+
+def start_flusher():
+    global _flusher
+    if not SESSION_WRITE_BEHIND or _flusher is not None:
+        return
+    _stop.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="session-flush", daemon=True)
+    _flusher.start()
+
+
+def stop_flusher():
+    global _flusher
+    if _flusher is not None:
+        _stop.set()
+        _flusher.join(timeout=5)
+        _flusher = None
+    flush()
+
+
+def session_stats() -> dict:
+    with _dirty_lock:
+        dirty = len(_dirty)
+    return {
+        "mode_cache": SESSION_MODE_CACHE,
+        "write_behind": SESSION_WRITE_BEHIND,
+        "dirty": dirty,
+        "modes": _modes.stats(),
+        "known_users": _known.stats(),
+    }
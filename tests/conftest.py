@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# ไม่แตะ .env จริง: token ปลอม + DB ชั่วคราว ต้องตั้งก่อน import โมดูลของแอป
+os.environ["LINE_CHANNEL_ACCESS_TOKEN"] = "test-token"
+os.environ["LINE_CHANNEL_SECRET"] = "test-secret"
+os.environ["DB_PATH"] = str(Path(tempfile.mkdtemp(prefix="moodiary_test_")) / "app.db")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,27 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app as app_module
+
+STATS_PATHS = ["/webhook/queue", "/webhook/session", "/webhook/render", "/webhook/routes",
+               "/webhook/push", "/webhook/scheduler", "/webhook/writer"]
+
+
+@pytest.fixture
+def client():
+    # ไม่เข้า lifespan: endpoint สถิติอ่านแค่ตัวนับใน memory
+    return TestClient(app_module.app)
+
+
+@pytest.mark.parametrize("path", STATS_PATHS)
+def test_stats_need_admin_token(monkeypatch, client, path):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"authorization": "Bearer nope"}).status_code == 401
+    assert client.get(path, headers={"authorization": "Bearer secret"}).status_code == 200
+
+
+@pytest.mark.parametrize("path", STATS_PATHS)
+def test_stats_hidden_without_token(monkeypatch, client, path):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "")
+    assert client.get(path, headers={"authorization": "Bearer "}).status_code == 404
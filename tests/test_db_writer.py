@@ -0,0 +1,52 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import db
+import db_writer
+
+USER_ID = "U" + "3" * 32
+
+
+def _fast_busy(path):
+    conn = db.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout=100")
+    return conn
+
+
+@pytest.fixture
+def writer():
+    db.init_db()
+    db.close_all()
+    db_writer.start(_fast_busy)
+    yield db.user_db_path(USER_ID)
+    db_writer.stop()
+
+
+def _submit(path):
+    return db_writer.submit(path, db._add_todo_tx, USER_ID, "x", datetime.utcnow().isoformat())
+
+
+def test_locked_database_fails_the_batch_but_keeps_the_writer(writer):
+    # เหมือน archive_diary.py/backfill_stats.py ถือ write lock อยู่นานเกิน busy_timeout
+    blocker = sqlite3.connect(writer, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        fut = _submit(writer)
+        assert isinstance(fut.exception(timeout=5), sqlite3.OperationalError)
+        assert db_writer.is_running()
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+
+    assert _submit(writer).result(timeout=5) is None
+
+
+def test_items_queued_after_stop_are_failed(writer):
+    db_writer._q.put(None)
+    db_writer._thread.join(5)
+    fut = _submit(writer)
+    db_writer.stop()
+    assert isinstance(fut.exception(timeout=1), RuntimeError)
+    assert not db_writer.is_running()
@@ -0,0 +1,54 @@
+import json
+
+import httpx
+import pytest
+
+import line_api
+import scheduler
+
+
+@pytest.fixture
+def line_stub(monkeypatch):
+    # แทน LINE API ด้วย MockTransport เก็บทุก request ไว้ตรวจ
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={})
+
+    client = httpx.Client(base_url=line_api.LINE_API_BASE, transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(line_api, "_sync_client", client)
+    yield sent
+    client.close()
+
+
+def _due(bed: list[str], wake: list[str]):
+    return lambda kind, minutes: {"bed": bed, "wake": wake}[kind]
+
+
+def _users(prefix: str, n: int) -> list[str]:
+    return [f"U{prefix}{i:031x}" for i in range(n)]
+
+
+@pytest.mark.parametrize("n, sizes", [(0, []), (1, [1]), (500, [500]), (501, [500, 1])])
+def test_due_users_split_into_multicast_batches(monkeypatch, line_stub, n, sizes):
+    users = _users("b", n)
+    monkeypatch.setattr(scheduler, "due_sleep_users", _due(users, []))
+
+    assert scheduler._dispatch_minutes([22 * 60]) == n
+    assert [path for path, _ in line_stub] == ["/v2/bot/message/multicast"] * len(sizes)
+    assert [len(body["to"]) for _, body in line_stub] == sizes
+    assert [u for _, body in line_stub for u in body["to"]] == users
+
+
+def test_bed_and_wake_users_go_out_separately(monkeypatch, line_stub):
+    bed, wake = _users("b", 3), _users("a", 2)
+    monkeypatch.setattr(scheduler, "due_sleep_users", _due(bed + bed[:1], wake))
+
+    assert scheduler._dispatch_minutes([6 * 60]) == 5
+    assert len(line_stub) == 2
+    (_, bed_body), (_, wake_body) = line_stub
+    assert bed_body["to"] == bed
+    assert bed_body["messages"] == [scheduler.BEDTIME_MESSAGE]
+    assert wake_body["to"] == wake
+    assert wake_body["messages"] == [scheduler.WAKETIME_MESSAGE]
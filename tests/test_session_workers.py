@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+import adb
+import db
+import session
+
+
+@pytest.fixture
+def multi_worker(monkeypatch):
+    # เหมือนรันด้วย WEB_CONCURRENCY > 1
+    monkeypatch.setattr(session, "SESSION_MODE_CACHE", False)
+    db.init_db()
+    yield
+    db.close_all()
+
+
+def test_mode_set_by_another_worker_is_seen(multi_worker):
+    user_id = "U" + "1" * 32
+    session.ensure_user(user_id)
+    assert asyncio.run(adb.get_mode(user_id)) is None
+
+    # worker อื่นเปลี่ยน mode ตรงใน SQLite
+    db.set_mode(user_id, "todo_wait_add")
+    assert asyncio.run(adb.get_mode(user_id)) == "todo_wait_add"
+
+
+def test_clearing_mode_always_reaches_sqlite(multi_worker):
+    user_id = "U" + "2" * 32
+    session.ensure_user(user_id)
+    asyncio.run(adb.set_mode(user_id, None))
+
+    db.set_mode(user_id, "diary_wait_text")
+    asyncio.run(adb.set_mode(user_id, None))
+    assert db.get_mode(user_id) is None